@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from libfurc import base
+
+#The character-at-a-time codec that base.py used to ship, kept for comparison
+def legacyB95encode(i, size = None):
+    out = b""
+    while i > 0:
+        out = bytes([i % 95 + 32]) + out
+        i = i // 95
+    
+    if size:
+        out = out[:size]
+        if len(out) < size:
+            out = b" "*(size - len(out)) + out
+    
+    return out
+
+def legacyB95decode(data):
+    out = 0
+    for c in data:
+        if c >= 32 and c < 127:
+            out = (out * 95) + (c - 32)
+        else:
+            raise ValueError("Invalid base95 character!")
+    return out
+
+def legacyB220encode(i, size = None):
+    out = b""
+    while i > 0:
+        out = out + bytes([i % 220 + 35])
+        i = i // 220
+    
+    if size:
+        out = out[:size]
+        if len(out) < size:
+            out = out + b"#"*(size - len(out))
+    
+    return out
+
+def legacyB220decode(data):
+    out = 0
+    i = 1
+    for c in data:
+        if c >= 35 and c < 255:
+            out = out + ((c - 35) * i)
+            i *= 220
+        else:
+            raise ValueError("Invalid base220 character!")
+    return out
+
+def bench(name, old, new, number):
+    tOld = min(timeit.repeat(old, number = number, repeat = 9))
+    tNew = min(timeit.repeat(new, number = number, repeat = 9))
+    print("{:<28} {:>10.1f} ns {:>10.1f} ns {:>7.2f}x".format(
+        name, tOld / number * 1e9, tNew / number * 1e9, tOld / tNew))
+
+def main():
+    print("{:<28} {:>13} {:>13} {:>8}".format("", "legacy", "tables", "speedup"))
+    
+    for size in (1, 2, 3, 4, 6):
+        v95 = 95 ** size // 3
+        v220 = 220 ** size // 3
+        e95 = base.b95encode(v95, size)
+        e220 = base.b220encode(v220, size)
+        bench("b95decode width {}".format(size),
+            lambda: legacyB95decode(e95), lambda: base.b95decode(e95), 200000)
+        bench("b220decode width {}".format(size),
+            lambda: legacyB220decode(e220), lambda: base.b220decode(e220), 200000)
+        bench("b95encode width {}".format(size),
+            lambda: legacyB95encode(v95, size), lambda: base.b95encode(v95, size), 200000)
+        bench("b220encode width {}".format(size),
+            lambda: legacyB220encode(v220, size), lambda: base.b220encode(v220, size), 200000)
+    
+    #In place decoding, what FurcBuffer.read95/read220 use, against slicing
+    #the field out and decoding it the old way
+    packet = b"A" + b"".join(base.b95encode(95 ** size // 3, size) for size in (1, 2, 3, 4, 6))
+    offset = 1
+    for size in (1, 2, 3, 4, 6):
+        o = offset
+        bench("b95decodeAt width {}".format(size),
+            lambda: legacyB95decode(packet[o:o + size]), lambda: base.b95decodeAt(packet, o, size), 200000)
+        offset += size
+    
+    #A SetFloor sized run of 2 wide base220 fields
+    values = [i % 48400 for i in range(30000)]
+    run = base.b220encodeMany(values, 2)
+    bench("b220 run of 30000 x 2",
+        lambda: [legacyB220decode(run[i:i+2]) for i in range(0, len(run), 2)],
+        lambda: base.b220decodeMany(run, 2), 20)
+    bench("b220 run of 30000 x 2 (H)",
+        lambda: [legacyB220decode(run[i:i+2]) for i in range(0, len(run), 2)],
+        lambda: base.b220decodeMany(run, 2, typecode = "H"), 20)
+
+if __name__ == "__main__":
+    main()
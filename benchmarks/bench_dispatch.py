@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from libfurc.client import PacketHooks
+from corpus import argument, load
+
+class LegacyHooks(PacketHooks):
+    #Dispatch the way PacketHooks used to, by building the name per packet
+    async def message_61(self, opcode, data):
+        if len(data) < 2:
+            return
+        await getattr(
+            self,
+            "message_61_" + str(data[0]-32),
+            self.message_61_unhandled
+        )(data[0]-32, data[1:])
+    
+    async def handlePacket(self, data):
+        await self.fire("Raw", data)
+        try:
+            await getattr(
+                self,
+                "message_" + str(data[0]-32),
+                self.message_unhandled
+            )(data[0]-32, data[1:])
+        except ValueError:
+            print("DECODE FAILED ", data)
+
+async def noop(*args, **kwargs):
+    pass
+
+def subscribe(hooks, events = None):
+    #Listen to every event by default, so nothing can be skipped undecoded
+    if events == None:
+        events = set()
+        for handler in hooks.handlers + hooks.handlers61:
+            events.update(getattr(handler, "fires", ()))
+    for event in events:
+        hooks.hook(event, noop)
+    return hooks
+
+async def replay(hooks, lines, rounds):
+    start = time.perf_counter()
+    for i in range(rounds):
+        for line in lines:
+            await hooks.handlePacket(line)
+    return len(lines) * rounds / (time.perf_counter() - start)
+
+async def compare(name, lines, rounds, events = None):
+    legacyHooks = subscribe(LegacyHooks(), events)
+    tableHooks = subscribe(PacketHooks(), events)
+    #Warm up both before measuring
+    await replay(legacyHooks, lines, 1)
+    await replay(tableHooks, lines, 1)
+    
+    #Alternate the two so drift on a busy machine hits both equally
+    legacy, table = 0, 0
+    for i in range(5):
+        legacy = max(legacy, await replay(legacyHooks, lines, rounds))
+        table = max(table, await replay(tableHooks, lines, rounds))
+    print("{}: {} packets per round, {} rounds".format(name, len(lines), rounds))
+    print("  getattr dispatch: {:>10.0f} packets/s".format(legacy))
+    print("  table dispatch:   {:>10.0f} packets/s ({:.2f}x)".format(table, table / legacy))
+
+async def main():
+    lines = load(argument())
+    await compare("Dream entry", lines, 5)
+    #Packets with next to no payload, so dispatch is most of the cost
+    await compare("Dispatch only", [b"~", b"=", b"]x", b"]w", b"&"] * 2000, 5)
+    #A chat bot, everything but chat and login is skipped without decoding
+    await compare("Message listener only", lines, 5, ["Message", "Login"])
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+import io
+import os
+import random
+import struct
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from libfurc import dream
+
+sUInt16 = struct.Struct("<H")
+sUInt8 = struct.Struct("<B")
+
+def syntheticMap(width = 1000, height = 1000, version = 1.6, seed = 0):
+    #A map file with random layers, written out by hand
+    rng = random.Random(seed)
+    cells = width * height
+    out = io.BytesIO()
+    out.write("MAP V{:.2f} Furcadia\n".format(version).encode())
+    out.write("width={}\nheight={}\nname=Synthetic\nrevision=1\n".format(width, height).encode())
+    out.write(b"BODY\n")
+    #Floors, items and walls, then regions and effects, then lighting and
+    #ambient. Every layer is cells * 2 bytes, walls being two per cell.
+    layers = 3
+    if version > 1.30:
+        layers += 2
+    if version > 1.50:
+        layers += 2
+    #Few distinct IDs, like real maps, from a small random pool
+    pool = bytes(rng.randrange(0, 256) for i in range(4096))
+    pool = pool * (cells * 2 // len(pool) + 2)
+    for i in range(layers):
+        out.write(pool[i:i + cells * 2])
+    return out.getvalue()
+
+def legacyLoad(data):
+    #How fromStream used to read the layers, one struct.unpack per cell
+    handle = io.BytesIO(data)
+    header = b""
+    while True:
+        b = handle.read(1)
+        if b == b"\n":
+            break
+        header += b
+    parameters = {}
+    while True:
+        param = b""
+        while True:
+            b = handle.read(1)
+            if b == b"\n":
+                break
+            param += b
+        if param == b"BODY":
+            break
+        key, value = param.decode().split("=", 1)
+        parameters[key] = value
+    width, height = int(parameters["width"]), int(parameters["height"])
+    layers = {}
+    for name, count, unpacker, size in (
+        ("floors", width * height, sUInt16, 2),
+        ("items", width * height, sUInt16, 2),
+        ("walls", width * height * 2, sUInt8, 1),
+        ("regions", width * height, sUInt16, 2),
+        ("effects", width * height, sUInt16, 2),
+        ("lighting", width * height, sUInt16, 2),
+        ("ambient", width * height, sUInt16, 2)
+    ):
+        layer = [0] * count
+        for i in range(count):
+            layer[i], = unpacker.unpack(handle.read(size))
+        layers[name] = layer
+    return layers
+
+def timed(func, *args):
+    best = None
+    for i in range(3):
+        start = time.perf_counter()
+        result = func(*args)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best == None else min(best, elapsed)
+    return best, result
+
+if __name__ == "__main__":
+    for width, height in ((200, 200), (500, 500), (1000, 1000)):
+        data = syntheticMap(width, height)
+        bulk, loaded = timed(dream.loads, data)
+        print("{}x{} map, {} bytes".format(width, height, len(data)))
+        print("  bulk:   {:8.1f}ms".format(bulk * 1000))
+        #Floor histogram, vectorized when NumPy is installed
+        vectorized, histogram = timed(loaded.histogram, "floors")
+        perTile, counts = timed(lambda: [loaded.floors[i] for i in range(width * height)])
+        print("  histogram: {:5.1f}ms (numpy {}), per tile reads {:.1f}ms".format(
+            vectorized * 1000, "yes" if dream.haveNumpy else "no", perTile * 1000
+        ))
+        #Filling the middle quarter of a copy, per tile and as one block
+        canvas = dream.loads(data)
+        def perTileFill():
+            for x in range(width // 4, width * 3 // 4):
+                for y in range(height // 4, height * 3 // 4):
+                    canvas.floors[x, y] = 5
+        def blockFill():
+            canvas.floors[width // 4:width * 3 // 4, height // 4:height * 3 // 4] = 5
+        tiles, _ = timed(perTileFill)
+        block, _ = timed(blockFill)
+        print("  fill:   {:8.1f}ms per tile, {:.2f}ms as a block".format(tiles * 1000, block * 1000))
+        written, out = timed(dream.dumps, loaded)
+        assert dream.loads(out).version == loaded.version
+        print("  dumps:  {:8.1f}ms".format(written * 1000))
+        if width * height <= 250000:
+            legacy, layers = timed(legacyLoad, data)
+            assert list(loaded._floors) == layers["floors"]
+            assert list(loaded._ambient) == layers["ambient"]
+            print("  legacy: {:8.1f}ms ({:.0f}x)".format(legacy * 1000, legacy / bulk))
+        
+        #Opening from disk, copied into arrays versus mapped
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "synthetic.map")
+            with open(path, "wb") as f:
+                f.write(data)
+            copied, loaded = timed(dream.Dream.open, path, False)
+            mapped, opened = timed(dream.Dream.open, path)
+            assert opened.floors[width - 1, height - 1] == loaded.floors[width - 1, height - 1]
+            opened.close()
+            print("  open:   {:8.1f}ms".format(copied * 1000))
+            print("  mmap:   {:8.3f}ms".format(mapped * 1000))
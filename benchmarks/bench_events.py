@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+import asyncio
+import gc
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from libfurc.client import PacketHooks
+from libfurc.furcbuffer import FurcBuffer
+from corpus import argument, dreamEntryBurst, load
+
+class LegacyEvents(PacketHooks):
+    #The handlers as PacketHooks had them before events became records,
+    #copied verbatim, firing dict payloads
+    async def message_22(self, opcode, data):
+        msg = FurcBuffer(data)
+        from_x = msg.read95(2)
+        from_y = msg.read95(2)
+        to_x = msg.read95(2)
+        to_y = msg.read95(2)
+        while msg.remaining >= 6:
+            line = msg.read95(2)
+            if line > 8000:
+                line = line - 8000 + (msg.read95(2) * 1000)
+            
+            extra_x = msg.read95(2)
+            extra_y = msg.read95(2)
+            
+            result = {
+                "from": (from_x, from_y),
+                "to": (to_x, to_y),
+                "extra": (extra_x, extra_y),
+                "line": line
+            }
+            await self.fire("DSEvent", True, result)
+    
+    async def message_24(self, opcode, data):
+        msg = FurcBuffer(data)
+        moveFlag = msg.read95(1)
+        randSeed = msg.read95(5)
+        try:
+            saidNum = msg.read95(3)
+        except ValueError:
+            #TEMPORARY: Fix for server sending non-base95 numbers
+            msg.offset -= 3
+            print("INVALID saidNum", msg.read(3))
+            saidNum = 0
+        facingDir = msg.read95(1)
+        try:
+            entryCode = msg.read95(3)
+        except ValueError:
+            #TEMPORARY: Fix for server sending non-base95 numbers
+            msg.offset -= 3
+            print("INVALID entryCode", msg.read(3))
+            entryCode = 0
+        objPaws =  msg.read95(3)
+        furreCount = msg.read95(2)
+        userID = msg.read95(6)
+        DSBtn = msg.read95(2)
+        dreamCookies = msg.read95(3)
+        triggererCookies = msg.read95(2)
+        portalOpen = (msg.read95(2), msg.read95(2))
+        second = msg.read95(1)
+        minute = msg.read95(1)
+        hour = msg.read95(1)
+        day = msg.read95(1)
+        month = msg.read95(1)
+        year = msg.read95(2)
+        portalClose = (msg.read95(2), msg.read95(2))
+        await self.fire("DSEventAddon", {
+            "moveFlag": moveFlag,
+            "randSeed": randSeed,
+            "saidNum": saidNum,
+            "facingDir": facingDir,
+            "entryCode": entryCode,
+            "objPaws": objPaws,
+            "furreCount": furreCount,
+            "userID": userID,
+            "DSBtn": DSBtn,
+            "dreamCookies": dreamCookies,
+            "triggererCookies": triggererCookies,
+            "portalOpen": portalOpen,
+            "second": second,
+            "minute": minute,
+            "hour": hour,
+            "day": day,
+            "month": month,
+            "year": year,
+            "portalClose": portalClose
+        })
+    
+    async def message_61_47(self, opcode, data):
+        msg = FurcBuffer(data)
+        result = {}
+        
+        while msg.remaining >= 12:
+            fuid = msg.read220(4)
+            
+            r, g, b = 0, 0, 0
+            
+            try:
+                #BGR encoding
+                b, g, r = bytes.fromhex(msg.read(6).decode())
+            except ValueError:
+                pass #Just ignore it, it's malformed
+            
+            intensity = msg.read220(2) & 0xFF #0 to 254
+            
+            result[fuid] = {
+                "color": [r, g, b],
+                "intensity": intensity
+            }
+        
+        await self.fire("Gloam", result)
+
+EVENTS = ("DSEvent", "DSEventAddon", "Gloam")
+
+def keeper(hooks):
+    #A listener that holds on to every payload, like a bot logging events
+    kept = []
+    async def keep(*args):
+        kept.append(args)
+    for event in EVENTS:
+        hooks.hook(event, keep)
+    return kept
+
+async def measure(cls, lines):
+    hooks = cls()
+    kept = keeper(hooks)
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    for line in lines:
+        await hooks.handlePacket(line)
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    
+    retained = sum(stat.size_diff for stat in after.compare_to(before, "filename"))
+    blocks = sum(stat.count_diff for stat in after.compare_to(before, "filename"))
+    
+    #Time without tracing, dropping the payloads as they arrive
+    hooks = cls()
+    async def drop(*args):
+        pass
+    for event in EVENTS:
+        hooks.hook(event, drop)
+    best = None
+    for i in range(5):
+        start = time.perf_counter()
+        for line in lines:
+            await hooks.handlePacket(line)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best == None else min(best, elapsed)
+    return len(kept), retained, blocks, best
+
+async def main():
+    path = argument()
+    lines = load(path) if path else dreamEntryBurst(tail = 20000)
+    lines = [line for line in lines if line[:1] in (b"6", b"8", b"]")]
+    print("{} packets".format(len(lines)))
+    results = {}
+    for name, cls in (("dicts", LegacyEvents), ("records", PacketHooks)):
+        count, retained, blocks, elapsed = await measure(cls, lines)
+        results[name] = (retained, elapsed)
+        print("{:8} {:6} events  {:8.1f} KiB retained  {:7} blocks  {:6.1f}ms".format(
+            name, count, retained / 1024, blocks, elapsed * 1000
+        ))
+    print("Memory {:.2f}x smaller, {:.2f}x faster".format(
+        results["dicts"][0] / results["records"][0],
+        results["dicts"][1] / results["records"][1]
+    ))
+
+if __name__ == "__main__":
+    asyncio.run(main())
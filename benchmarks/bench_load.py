@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from libfurc.account import Character
+from libfurc.client import Client
+from libfurc.mockserver import MockServer
+from corpus import argument, load
+
+#Many clients against one mock server: time to the Dragonroar handshake,
+#time from sending the login to "&", and combined decode throughput.
+
+async def session(address, i, events):
+    client = Client(address, chunked = True)
+    loggedIn = asyncio.get_running_loop().create_future()
+    async def login(success):
+        if not loggedIn.done():
+            loggedIn.set_result(time.perf_counter())
+    client.hook("Login", login)
+    async def noop(*args):
+        pass
+    for event in events:
+        client.hook(event, noop)
+    
+    start = time.perf_counter()
+    await client.connect()
+    handshake = time.perf_counter()
+    await client.login(Character.fromINI("Bot{}".format(i), password = "password"))
+    await client.flush()
+    reader = asyncio.ensure_future(client.run())
+    await loggedIn
+    await reader
+    return handshake - start, loggedIn.result() - handshake, time.perf_counter() - start
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+async def main():
+    lines = load(argument())
+    events = ["Message", "MoveAvatar", "AnimateAvatar", "SpawnAvatar", "SetFloor"]
+    for clients in (10, 100, 500):
+        server = MockServer(lines, hangup = True)
+        address = await server.start()
+        start = time.perf_counter()
+        results = await asyncio.gather(*[session(address, i, events) for i in range(clients)])
+        elapsed = time.perf_counter() - start
+        await server.close()
+        
+        handshakes = [r[0] for r in results]
+        logins = [r[1] for r in results]
+        print("{} clients, {} packets each, {:.2f}s".format(clients, len(lines), elapsed))
+        print("  handshake: p50 {:7.1f}ms  p99 {:7.1f}ms".format(percentile(handshakes, 0.5) * 1000, percentile(handshakes, 0.99) * 1000))
+        print("  login:     p50 {:7.1f}ms  p99 {:7.1f}ms".format(percentile(logins, 0.5) * 1000, percentile(logins, 0.99) * 1000))
+        print("  decoded:   {:10.0f} packets/s".format(clients * len(lines) / elapsed))
+
+if __name__ == "__main__":
+    asyncio.run(main())
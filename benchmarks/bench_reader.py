@@ -0,0 +1,50 @@
+#!/usr/bin/env python3
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from libfurc.client import Client
+from libfurc.mockserver import MockServer
+from corpus import argument, load
+
+async def noop(*args, **kwargs):
+    pass
+
+async def measure(address, chunked, events):
+    client = Client(address, chunked = chunked)
+    for event in events:
+        client.hook(event, noop)
+    await client.connect()
+    start = time.perf_counter()
+    await client.run()
+    return time.perf_counter() - start
+
+async def main():
+    lines = load(argument()) * 4
+    payload = b"".join(line + b"\n" for line in lines)
+    #Stream the burst as soon as the handshake is done, then hang up
+    server = MockServer(lines, requireLogin = False, hangup = True)
+    address = await server.start()
+    
+    allEvents = set()
+    client = Client()
+    for handler in client.handlers + client.handlers61:
+        allEvents.update(getattr(handler, "fires", ()))
+    
+    for name, events in (("Raw only", ["Raw"]), ("All events", allEvents)):
+        readline, chunked = None, None
+        for i in range(5):
+            t = await measure(address, False, events)
+            readline = t if readline == None else min(readline, t)
+            t = await measure(address, True, events)
+            chunked = t if chunked == None else min(chunked, t)
+        print("{}: {} packets, {} bytes".format(name, len(lines), len(payload)))
+        print("  readline: {:>10.0f} packets/s".format(len(lines) / readline))
+        print("  chunked:  {:>10.0f} packets/s ({:.2f}x)".format(len(lines) / chunked, readline / chunked))
+    
+    await server.close()
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+import os
+import random
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from libfurc import base
+from libfurc.furcbuffer import FurcBuffer
+from libfurc.capture import CaptureReader, CaptureWriter
+
+#Synthetic stand-in for a recorded dream entry: the server sends the map
+#tiles, then a spawn for every furre present, then a steady stream of moves,
+#chat and lighting updates. Seeded, so every run replays the same packets.
+
+def _tiles(opcode, rng, count, maxID):
+    msg = FurcBuffer()
+    msg.write(opcode)
+    for i in range(count):
+        repeats = rng.randrange(0, 8)
+        msg.write220(rng.randrange(0, 200) + 1000 * (repeats // 48), 2)
+        msg.write220(rng.randrange(0, 200) + 1000 * (repeats % 48), 2)
+        msg.write220(rng.randrange(0, maxID), 2)
+    return msg.getvalue()
+
+def _colors(rng):
+    msg = FurcBuffer()
+    msg.write(b"w")
+    for i in range(14):
+        msg.write220(rng.randrange(0, 30), 1)
+    return msg.getvalue()
+
+def _spawn(rng, fuid):
+    name = "Furre{}".format(fuid).encode()
+    msg = FurcBuffer()
+    msg.write(b"<")
+    msg.write220(fuid, 4)
+    msg.write220(rng.randrange(0, 200), 2)
+    msg.write220(rng.randrange(0, 200), 2)
+    msg.write220(rng.randrange(0, 4), 1)
+    msg.write220(rng.randrange(0, 20), 1)
+    msg.write220(len(name), 1)
+    msg.write(name)
+    msg.write(_colors(rng))
+    msg.write220(0, 1)
+    msg.write220(0, 4)
+    msg.write220(100, 1)
+    return msg.getvalue()
+
+def _move(rng, fuid, opcode = b"A"):
+    msg = FurcBuffer()
+    msg.write(opcode)
+    msg.write220(fuid, 4)
+    msg.write220(rng.randrange(0, 200), 2)
+    msg.write220(rng.randrange(0, 200), 2)
+    msg.write220(rng.randrange(0, 4), 1)
+    msg.write220(rng.randrange(0, 20), 1)
+    return msg.getvalue()
+
+def _gloam(rng, fuids):
+    msg = FurcBuffer()
+    msg.write(b"]O")
+    for fuid in fuids:
+        msg.write220(fuid, 4)
+        msg.write("{:02x}{:02x}{:02x}".format(*[rng.randrange(0, 256) for i in range(3)]).encode())
+        msg.write220(rng.randrange(0, 255), 2)
+    return msg.getvalue()
+
+def _dsEvent(rng):
+    msg = FurcBuffer()
+    msg.write(b"6")
+    for i in range(4):
+        msg.write95(rng.randrange(0, 200), 2)
+    for i in range(3):
+        msg.write95(rng.randrange(0, 8000), 2)
+        msg.write95(rng.randrange(0, 200), 2)
+        msg.write95(rng.randrange(0, 200), 2)
+    return msg.getvalue()
+
+def _dsAddon(rng):
+    msg = FurcBuffer()
+    msg.write(b"8")
+    for size in (1, 5, 3, 1, 3, 3, 2, 6, 2, 3, 2, 2, 2, 1, 1, 1, 1, 1, 2, 2, 2):
+        msg.write95(rng.randrange(0, 95 ** min(size, 2)), size)
+    return msg.getvalue()
+
+def _text(rng, i):
+    msg = FurcBuffer()
+    msg.write(b"]s")
+    msg.write95(rng.randrange(0, 200), 2)
+    msg.write95(rng.randrange(0, 200), 2)
+    msg.write("1 owner{} dream{} 0 0".format(i, i).encode())
+    return msg.getvalue()
+
+def dreamEntryBurst(seed = 0, furres = 200, tilePackets = 40, tail = 4000):
+    rng = random.Random(seed)
+    lines = [
+        b"]ccmarble.bmp",
+        b";dream.map",
+        b"]r 0 patch 12345678",
+        b"]oSomeone",
+        b"]j" + base.b95encode(12, 2),
+        b"~",
+    ]
+    for opcode in (b"1", b"2", b">", b"5", b"E", b"F"):
+        for i in range(tilePackets):
+            lines.append(_tiles(opcode, rng, 150, 2000))
+    
+    fuids = [100000 + i for i in range(furres)]
+    for fuid in fuids:
+        lines.append(_spawn(rng, fuid))
+    lines.append(_gloam(rng, fuids))
+    lines.append(b"=")
+    lines.append(b"&")
+    
+    for i in range(tail):
+        r = rng.random()
+        fuid = rng.choice(fuids)
+        if r < 0.45:
+            lines.append(_move(rng, fuid))
+        elif r < 0.65:
+            lines.append(_move(rng, fuid, b"/"))
+        elif r < 0.8:
+            lines.append("(<name shortname='furre{0}'>Furre{0}</name>: hello there number {1}".format(fuid, i).encode())
+        elif r < 0.88:
+            #The server sends the addon ahead of the DS event it belongs to
+            lines.append(_dsAddon(rng))
+            lines.append(_dsEvent(rng))
+        elif r < 0.93:
+            lines.append(_text(rng, i))
+        elif r < 0.97:
+            lines.append(_gloam(rng, rng.sample(fuids, 5)))
+        else:
+            lines.append(b"!" + base.b95encode(rng.randrange(0, 100), 2))
+    
+    return lines
+
+def load(path = None):
+    #Packets from a capture file if one is given, the synthetic burst if not
+    if path == None:
+        return dreamEntryBurst()
+    return CaptureReader(path).lines()
+
+def argument():
+    #Benchmarks take an optional capture file as their first argument
+    return sys.argv[1] or None if len(sys.argv) > 1 else None
+
+if __name__ == "__main__":
+    lines = dreamEntryBurst()
+    print("{} packets, {} bytes".format(len(lines), sum(len(l) + 1 for l in lines)))
+    if len(sys.argv) > 1:
+        #Write the burst out as a capture, paced at 1000 packets a second
+        with CaptureWriter(sys.argv[1], sys.argv[1].endswith(".gz")) as capture:
+            for i, line in enumerate(lines):
+                capture.write(line, i / 1000)
+        print("Wrote {}".format(sys.argv[1]))
@@ -0,0 +1,31 @@
+#!/usr/bin/env python3
+import asyncio
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from libfurc.client import PacketHooks
+from libfurc.profiler import DecodeProfiler
+from bench_dispatch import subscribe
+from corpus import argument, load
+
+#Which decoders the burst (or a capture given as the first argument) spends
+#its time in. A second argument writes collapsed stacks for flamegraph.pl.
+
+async def main():
+    lines = load(argument())
+    hooks = subscribe(PacketHooks())
+    profiler = DecodeProfiler(hooks)
+    profiler.enable()
+    for i in range(5):
+        for line in lines:
+            await hooks.handlePacket(line)
+    profiler.disable()
+    
+    print(profiler.report(limit = 20))
+    if len(sys.argv) > 2:
+        profiler.writeCollapsed(sys.argv[2])
+        print("Wrote {}".format(sys.argv[2]))
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -1,5 +1,7 @@
 #!/usr/bin/env
 import libfurc
+from libfurc.pool import ClientPool
+from libfurc.scheduler import CommandScheduler
 import argparse
 import getpass
 import asyncio
@@ -74,7 +76,8 @@ class Bot:
         self.data = data or {}
         self.visited = visited or []
         self.toVisit = toVisit or []
-        self.client = libfurc.Client()
+        #The scheduler paces commands to the server's limits for us
+        self.client = libfurc.Client(scheduler = CommandScheduler())
         self.currentDream = None
         self.timeSinceLast = time.time()
         self.onVisit = onVisit
@@ -168,9 +171,7 @@ class Bot:
             self.currentDream.ownerraw = self.dreamowner
             self.currentDream.mapfile = self.mapfile
             await self.client.vascodagama()
-            await asyncio.sleep(0.1)
             await self.client.command("dreambookmark 0")
-            await asyncio.sleep(0.1)
             await self.client.command("which")
             self.currentDream.available = True
             self.dreamowner = None
@@ -238,7 +239,9 @@ async def main():
     data = {}
     visited = []
     toVisit = [DreamVisit(gomap = i) for i in range(95)]
-    clients = []
+    #Bots disconnect once there's nothing left to visit, so don't restart
+    #them, and keep the whole pool to the limits of a single client
+    pool = ClientPool(concurrency = 4, rate = 8.0, burst = 10.0, restart = False)
     with open("dreams.jsons", "w") as f:
         def onVisit(dream):
             if dream:
@@ -247,13 +250,8 @@ async def main():
         for character in characters:
             print("Logging into {}".format(character.name))
             client = Bot(character.name, data, visited, toVisit, onVisit).client
-            motd = await client.connect()
-            if not motd:
-                print("Failed to connect to {}".format(character.name))
-                continue
-            await client.login(character, args.id)
-            clients.append(client)
+            pool.add(character, client = client, machineid = args.id)
         
-        await asyncio.gather(*[client.run() for client in clients])
+        await pool.run()
 
 asyncio.run(main())
\ No newline at end of file
@@ -1,10 +1,97 @@
 #!/usr/bin/env python3
+from array import array
+from operator import add
 
-def b95encode(i, size = None):
-    out = b""
+#Fixed widths that get precomputed tables, anything wider uses the slow path
+MAX_TABLE_WIDTH = 6
+
+#Digit value for invalid characters. It is negative and larger than any valid
+#sum of table entries, so a single "< 0" check after adding validates a field.
+_INVALID = -(1 << 62)
+
+def _digitTable(first, radix):
+    return [c - first if first <= c < first + radix else _INVALID for c in range(256)]
+
+def _weightedTables(digits, weights):
+    return [[d * w if d >= 0 else _INVALID for d in digits] for w in weights]
+
+def _makeDecoder(tables):
+    #One explicit function per width keeps the hot path free of loops
+    width = len(tables)
+    if width == 1:
+        t0, = tables
+        def decode(data):
+            a, = data
+            return t0[a]
+    elif width == 2:
+        t0, t1 = tables
+        def decode(data):
+            a, b = data
+            return t0[a] + t1[b]
+    elif width == 3:
+        t0, t1, t2 = tables
+        def decode(data):
+            a, b, c = data
+            return t0[a] + t1[b] + t2[c]
+    elif width == 4:
+        t0, t1, t2, t3 = tables
+        def decode(data):
+            a, b, c, d = data
+            return t0[a] + t1[b] + t2[c] + t3[d]
+    elif width == 5:
+        t0, t1, t2, t3, t4 = tables
+        def decode(data):
+            a, b, c, d, e = data
+            return t0[a] + t1[b] + t2[c] + t3[d] + t4[e]
+    elif width == 6:
+        t0, t1, t2, t3, t4, t5 = tables
+        def decode(data):
+            a, b, c, d, e, f = data
+            return t0[a] + t1[b] + t2[c] + t3[d] + t4[e] + t5[f]
+    else:
+        raise ValueError("No table decoder for width {}".format(width))
+    return decode
+
+#Base95 is big endian, most significant digit first
+_B95_DIGITS = _digitTable(32, 95)
+_B95_TABLES = [None] + [
+    _weightedTables(_B95_DIGITS, [95 ** (size - 1 - i) for i in range(size)])
+    for size in range(1, MAX_TABLE_WIDTH + 1)
+]
+_B95_DECODERS = [lambda data: 0] + [
+    _makeDecoder(_B95_TABLES[size]) for size in range(1, MAX_TABLE_WIDTH + 1)
+]
+_B95_LIMITS = [95 ** size for size in range(MAX_TABLE_WIDTH + 1)]
+_B95_HIGH = _B95_TABLES[2][0]
+_B95_T30, _B95_T31, _B95_T32 = _B95_TABLES[3]
+
+#Every valid base95 field of width 1 and 2, about 9000 entries and under a
+#megabyte, so the most common fields decode with a single dict lookup
+_B95_SHORT = {bytes((a + 32,)): a for a in range(95)}
+_B95_SHORT.update((bytes((a + 32, b + 32)), a * 95 + b) for a in range(95) for b in range(95))
+
+#Base220 is little endian, least significant digit first
+_B220_DIGITS = _digitTable(35, 220)
+_B220_TABLES = [None] + [
+    _weightedTables(_B220_DIGITS, [220 ** i for i in range(size)])
+    for size in range(1, MAX_TABLE_WIDTH + 1)
+]
+_B220_DECODERS = [lambda data: 0] + [
+    _makeDecoder(_B220_TABLES[size]) for size in range(1, MAX_TABLE_WIDTH + 1)
+]
+_B220_LIMITS = [220 ** size for size in range(MAX_TABLE_WIDTH + 1)]
+_B220_HIGH = _B220_TABLES[2][1]
+
+#Single character encodings
+_B95_CHARS = [bytes([i + 32]) for i in range(95)]
+_B220_CHARS = [bytes([i + 35]) for i in range(220)]
+
+def _b95encodeSlow(i, size = None):
+    digits = []
     while i > 0:
-        out = bytes([i % 95 + 32]) + out
-        i = i // 95
+        i, d = divmod(i, 95)
+        digits.append(d + 32)
+    out = bytes(reversed(digits))
     
     #Pad if needed
     if size:
@@ -14,7 +101,53 @@ def b95encode(i, size = None):
     
     return out
 
+def b95encode(i, size = None):
+    if size and size <= MAX_TABLE_WIDTH and 0 <= i < _B95_LIMITS[size]:
+        if size == 1:
+            return _B95_CHARS[i]
+        if size == 2:
+            return bytes((i // 95 + 32, i % 95 + 32))
+        if size == 3:
+            return bytes((i // 9025 + 32, i // 95 % 95 + 32, i % 95 + 32))
+        if size == 4:
+            return bytes((i // 857375 + 32, i // 9025 % 95 + 32, i // 95 % 95 + 32, i % 95 + 32))
+        digits = [0] * size
+        for n in range(size - 1, -1, -1):
+            i, d = divmod(i, 95)
+            digits[n] = d + 32
+        return bytes(digits)
+    return _b95encodeSlow(i, size)
+
 def b95decode(data):
+    size = len(data)
+    #Widths 1 and 2 are the bulk of all fields
+    if size < 3:
+        try:
+            out = _B95_SHORT.get(data)
+        except TypeError: #bytearray and writable memoryviews aren't hashable
+            out = None
+        if out is not None:
+            return out
+    
+    #Short fields that missed the dict, and width 3, skip the decoder call
+    if size == 3:
+        a, b, c = data
+        out = _B95_T30[a] + _B95_T31[b] + _B95_T32[c]
+    elif size == 2:
+        a, b = data
+        out = _B95_HIGH[a] + _B95_DIGITS[b]
+    elif size == 1:
+        out = _B95_DIGITS[data[0]]
+    elif size <= MAX_TABLE_WIDTH:
+        out = _B95_DECODERS[size](data)
+    else:
+        out = None
+    
+    if out is not None:
+        if out < 0:
+            raise ValueError("Invalid base95 character!")
+        return out
+    
     out = 0
     for c in data:
         if c >= 32 and c < 127:
@@ -23,11 +156,12 @@ def b95decode(data):
             raise ValueError("Invalid base95 character!")
     return out
 
-def b220encode(i, size = None):
-    out = b""
+def _b220encodeSlow(i, size = None):
+    out = bytearray()
     while i > 0:
-        out = out + bytes([i % 220 + 35])
-        i = i // 220
+        i, d = divmod(i, 220)
+        out.append(d + 35)
+    out = bytes(out)
     
     #Pad if needed
     if size:
@@ -37,7 +171,37 @@ def b220encode(i, size = None):
     
     return out
 
+def b220encode(i, size = None):
+    if size and size <= MAX_TABLE_WIDTH and 0 <= i < _B220_LIMITS[size]:
+        if size == 1:
+            return _B220_CHARS[i]
+        if size == 2:
+            return bytes((i % 220 + 35, i // 220 + 35))
+        digits = [0] * size
+        for n in range(size):
+            i, d = divmod(i, 220)
+            digits[n] = d + 35
+        return bytes(digits)
+    return _b220encodeSlow(i, size)
+
 def b220decode(data):
+    size = len(data)
+    #Widths 1 and 2 are the bulk of all fields, so they skip the decoder call
+    if size == 2:
+        a, b = data
+        out = _B220_DIGITS[a] + _B220_HIGH[b]
+    elif size == 1:
+        out = _B220_DIGITS[data[0]]
+    elif size <= MAX_TABLE_WIDTH:
+        out = _B220_DECODERS[size](data)
+    else:
+        out = None
+    
+    if out is not None:
+        if out < 0:
+            raise ValueError("Invalid base220 character!")
+        return out
+    
     out = 0
     i = 1
     for c in data:
@@ -48,6 +212,87 @@ def b220decode(data):
             raise ValueError("Invalid base220 character!")
     return out
 
+#Decoding in place, for callers holding a larger buffer (bytes, bytearray or
+#memoryview) that don't want to slice out a copy of every field.
+def b95decodeAt(data, offset, size):
+    if size == 2:
+        out = _B95_HIGH[data[offset]] + _B95_DIGITS[data[offset + 1]]
+    elif size == 1:
+        out = _B95_DIGITS[data[offset]]
+    elif size == 3:
+        out = _B95_T30[data[offset]] + _B95_T31[data[offset + 1]] + _B95_T32[data[offset + 2]]
+    elif size <= MAX_TABLE_WIDTH:
+        out = _B95_DECODERS[size](data[offset:offset + size])
+    else:
+        return b95decode(data[offset:offset + size])
+    
+    if out < 0:
+        raise ValueError("Invalid base95 character!")
+    return out
+
+def b220decodeAt(data, offset, size):
+    if size == 2:
+        out = _B220_DIGITS[data[offset]] + _B220_HIGH[data[offset + 1]]
+    elif size == 1:
+        out = _B220_DIGITS[data[offset]]
+    else:
+        return b220decode(data[offset:offset + size])
+    
+    if out < 0:
+        raise ValueError("Invalid base220 character!")
+    return out
+
+#Batch decoding
+def _decodeMany(tables, name, data, size, count, offset, typecode):
+    if size < 1 or size > MAX_TABLE_WIDTH:
+        raise ValueError("Batch {} decoding supports widths 1 to {}".format(name, MAX_TABLE_WIDTH))
+    
+    available = (len(data) - offset) // size
+    if count is None:
+        count = available
+    elif count > available:
+        raise ValueError("Not enough data for {} {} fields of width {}".format(count, name, size))
+    
+    end = offset + count * size
+    #Each digit position is a strided slice, so the whole run is decoded by
+    #C level map() calls instead of one Python call per field.
+    result = map(tables[0].__getitem__, data[offset:end:size])
+    for i in range(1, size):
+        result = map(add, result, map(tables[i].__getitem__, data[offset + i:end:size]))
+    result = list(result)
+    
+    if result and min(result) < 0:
+        raise ValueError("Invalid {} character!".format(name))
+    
+    if typecode is not None:
+        return array(typecode, result)
+    return result
+
+def b95decodeMany(data, size, count = None, offset = 0, typecode = None):
+    """
+        Decode `count` consecutive base95 fields of `size` characters each,
+        starting at `offset`. If count is None, decode as many whole fields
+        as the data holds. Returns a list, or an array if typecode is given.
+    """
+    return _decodeMany(_B95_TABLES[size] if 0 < size <= MAX_TABLE_WIDTH else None,
+        "base95", data, size, count, offset, typecode)
+
+def b220decodeMany(data, size, count = None, offset = 0, typecode = None):
+    """
+        Decode `count` consecutive base220 fields of `size` characters each,
+        starting at `offset`. If count is None, decode as many whole fields
+        as the data holds. Returns a list, or an array if typecode is given.
+    """
+    return _decodeMany(_B220_TABLES[size] if 0 < size <= MAX_TABLE_WIDTH else None,
+        "base220", data, size, count, offset, typecode)
+
+#Batch encoding
+def b95encodeMany(values, size):
+    return b"".join([b95encode(v, size) for v in values])
+
+def b220encodeMany(values, size):
+    return b"".join([b220encode(v, size) for v in values])
+
 def unitTests():
     b95Tests = [
         ((0, None), b''),
@@ -89,6 +334,53 @@ def unitTests():
     for test in b220Tests:
         assert b220decode(test[1]) == test[0][0], "Base220 decode for {} (Padding: {}) failed!".format(*test[0])
 
+    #Table widths must agree with the slow path, including overflow truncation
+    for size in range(1, MAX_TABLE_WIDTH + 2):
+        for v in (0, 1, 94, 95, 219, 220, 9024, 48399, 95 ** size - 1, 220 ** size - 1, 220 ** size):
+            assert b95encode(v, size) == _b95encodeSlow(v, size), "Base95 table encode for {} ({}) failed!".format(v, size)
+            assert b220encode(v, size) == _b220encodeSlow(v, size), "Base220 table encode for {} ({}) failed!".format(v, size)
+            if v < 95 ** size:
+                assert b95decode(b95encode(v, size)) == v, "Base95 round trip for {} ({}) failed!".format(v, size)
+            if v < 220 ** size:
+                assert b220decode(b220encode(v, size)) == v, "Base220 round trip for {} ({}) failed!".format(v, size)
+    
+    for data in (b"\x1f", b" \x7f", b"!!!\n"):
+        try:
+            b95decode(data)
+        except ValueError:
+            pass
+        else:
+            assert False, "Base95 decode of {} should have failed!".format(data)
+    
+    for data in (b"\xff", b"#\x22", b"###\xff"):
+        try:
+            b220decode(data)
+        except ValueError:
+            pass
+        else:
+            assert False, "Base220 decode of {} should have failed!".format(data)
+    
+    #Batch decoding
+    values = [0, 1, 583, 2299, 9024]
+    for size in range(2, MAX_TABLE_WIDTH + 1):
+        assert b95decodeMany(b95encodeMany(values, size), size) == values, "Base95 batch decode ({}) failed!".format(size)
+        assert b220decodeMany(b220encodeMany(values, size), size) == values, "Base220 batch decode ({}) failed!".format(size)
+    
+    assert b220decodeMany(b"xx" + b220encodeMany(values, 2) + b"x", 2, 3, 2) == values[:3], "Base220 batch offset failed!"
+    assert b220decodeMany(memoryview(b220encodeMany(values, 2)), 2, typecode = "H") == array("H", values), "Base220 batch array failed!"
+    
+    for data in (b"xx#$", bytearray(b"xx#$"), memoryview(b"xx#$")):
+        assert b95decodeAt(data, 2, 2) == 289, "Base95 decode at offset failed!"
+        assert b220decodeAt(data, 2, 2) == 220, "Base220 decode at offset failed!"
+        assert b220decodeAt(data, 1, 3) == b220decode(b"x#$"), "Base220 decode at offset failed!"
+    
+    try:
+        b95decodeMany(b"  !!\x01 ", 2)
+    except ValueError:
+        pass
+    else:
+        assert False, "Base95 batch decode of invalid data should have failed!"
+
 
 if __name__ == "__main__":
-    unitTests()
\ No newline at end of file
+    unitTests()
@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+import asyncio
+import gzip
+import struct
+import time
+
+#Capture files hold raw server lines with the time they arrived.
+#
+#Header: b"FCAP", format version, capture start as a unix time double.
+#Records: microseconds since the previous record and the line length,
+#then the line without its EOL. Reopening a capture to append to it
+#writes a SESSION record holding the new start time, so the timestamps
+#stay correct across sessions. A gap too long for a record's delta (over
+#about 71 minutes) is written first as a GAP record holding the whole
+#delta as a 64 bit count of microseconds.
+#
+#Compressed captures are the same stream gzipped; every append adds a
+#gzip member and gzip reads them back as one stream.
+
+MAGIC = b"FCAP"
+VERSION = 2 #2 added GAP records
+SESSION = 0xFFFFFFFF
+GAP = 0xFFFFFFFE
+
+sHeader = struct.Struct("<4sBd")
+sRecord = struct.Struct("<II")
+sTime = struct.Struct("<d")
+sGap = struct.Struct("<Q")
+
+def _isGzip(path):
+    with open(path, "rb") as f:
+        return f.read(2) == b"\x1f\x8b"
+
+class CaptureWriter:
+    def __init__(self, path, compress = False):
+        self.path = path
+        try:
+            with open(path, "rb") as f:
+                existing = len(f.read(1)) > 0
+            if existing:
+                #Keep appending in whatever form the file already is
+                compress = _isGzip(path)
+        except FileNotFoundError:
+            existing = False
+        
+        self.compress = compress
+        if compress:
+            self.handle = gzip.open(path, "ab")
+        else:
+            self.handle = open(path, "ab")
+        
+        self.start = time.time()
+        self.clock = time.monotonic()
+        self.last = 0
+        if existing:
+            self.handle.write(sRecord.pack(SESSION, sTime.size) + sTime.pack(self.start))
+        else:
+            self.handle.write(sHeader.pack(MAGIC, VERSION, self.start))
+        self.records = 0
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *args):
+        self.close()
+    
+    def write(self, line, timestamp = None):
+        #timestamp is in seconds since this writer was opened
+        if timestamp == None:
+            timestamp = time.monotonic() - self.clock
+        now = int(timestamp * 1000000)
+        delta = max(0, now - self.last)
+        self.last += delta
+        if delta >= GAP:
+            self.handle.write(sRecord.pack(GAP, sGap.size) + sGap.pack(delta))
+            delta = 0
+        self.handle.write(sRecord.pack(delta, len(line)))
+        self.handle.write(line)
+        self.records += 1
+    
+    def flush(self):
+        self.handle.flush()
+    
+    def close(self):
+        if self.handle != None:
+            self.handle.close()
+            self.handle = None
+
+class CaptureReader:
+    def __init__(self, path):
+        self.path = path
+        self.start = None
+    
+    def __iter__(self):
+        """
+            Yields (timestamp, line) pairs, timestamp being seconds since the
+            capture was started.
+        """
+        if _isGzip(self.path):
+            handle = gzip.open(self.path, "rb")
+        else:
+            handle = open(self.path, "rb")
+        
+        with handle:
+            magic, version, start = sHeader.unpack(handle.read(sHeader.size))
+            if magic != MAGIC:
+                raise ValueError("Not a capture file!")
+            if version > VERSION:
+                raise ValueError("Unsupported capture version {}".format(version))
+            self.start = start
+            
+            base = 0.0
+            elapsed = 0
+            while True:
+                try:
+                    header = handle.read(sRecord.size)
+                    if len(header) < sRecord.size:
+                        break #A truncated record means the writer died mid-write
+                    delta, length = sRecord.unpack(header)
+                    line = handle.read(length)
+                except EOFError: #Same, for a truncated gzip member
+                    break
+                if len(line) < length:
+                    break
+                
+                if delta == SESSION:
+                    #Later session, continue the clock from its own start
+                    base = sTime.unpack(line)[0] - start
+                    elapsed = 0
+                    continue
+                
+                if delta == GAP:
+                    elapsed += sGap.unpack(line)[0]
+                    continue
+                
+                elapsed += delta
+                yield base + elapsed / 1000000, line
+    
+    def lines(self):
+        return [line for timestamp, line in self]
+
+class Recorder:
+    """
+        Writes every raw line a client receives to a capture file. It listens
+        to the Raw event, so it doesn't cause anything else to be decoded.
+    """
+    def __init__(self, client, path, compress = False):
+        self.client = client
+        self.writer = CaptureWriter(path, compress)
+        client.hook("Raw", self.record)
+    
+    async def record(self, data):
+        self.writer.write(bytes(data))
+    
+    def close(self):
+        self.client.off("Raw", self.record)
+        self.writer.close()
+
+async def replay(hooks, capture, speed = None):
+    """
+        Feed a capture, a path or a CaptureReader, into any PacketHooks. With
+        speed None lines go in as fast as they are handled, otherwise the
+        original pacing is kept, scaled by speed (2.0 is twice as fast).
+        Returns (packets, bytes, seconds).
+    """
+    if type(capture) == str:
+        capture = CaptureReader(capture)
+    
+    packets, size = 0, 0
+    started = time.monotonic()
+    for timestamp, line in capture:
+        if speed != None:
+            delay = timestamp / speed - (time.monotonic() - started)
+            if delay > 0:
+                await asyncio.sleep(delay)
+        packets += 1
+        size += len(line) + 1
+        if len(line) == 0:
+            continue
+        await hooks.handlePacket(line)
+    return packets, size, time.monotonic() - started
@@ -5,9 +5,15 @@ from .furcbuffer import FurcBuffer
 from .account import Character
 from .colors import Colors
 from .particles import Particles
+from .tiles import TileUpdates
+from . import events
+from .listeners import Listener, HIGH_PRIORITY_EVENTS, LOW_PRIORITY_EVENTS
+from .metrics import Metrics, MemorySink, opcodeName
 import datetime
+import random
+import socket
+import struct
 import time
-import math
 import logging
 
 LIVE_SERVER = ("lightbringer.furcadia.com", 6500)
@@ -17,63 +23,142 @@ class DefaultPacketHandler:
     async def message_unhandled(self, opcode, data):
         logging.error("Unhandled {}".format(opcode), data)
 
+#Opcodes are a single base95 character, so there are at most this many
+OPCODE_COUNT = 95
+
+def fires(*events):
+    #Marks the events a handler can fire, so PacketHooks can skip decoding
+    #packets that nobody is listening for
+    def _(func):
+        func.fires = frozenset(events)
+        return func
+    return _
+
 class PacketHooks(DefaultPacketHandler):
+    #Listeners taking longer than this many seconds get logged
+    slowListenerTime = 0.1
+    
     def __init__(self, useLookups = False):
         self.listeners = {
             "*": []
         }
+        self.eventPriority = {}
+        for name in HIGH_PRIORITY_EVENTS:
+            self.eventPriority[name] = Listener.PRIORITY_HIGH
+        for name in LOW_PRIORITY_EVENTS:
+            self.eventPriority[name] = Listener.PRIORITY_LOW
+        self.subscribed = set()
         self.lookup = None
-        if useLookups:
-            self.generateLookups()
+        self.metrics = None
+        self.loginSent = None
+        self.generateLookups()
+    
+    @classmethod
+    def _classDispatch(cls):
+        #Resolved once per class, subclasses get their own tables
+        tables = cls.__dict__.get("_dispatchTables")
+        if tables == None:
+            opcodes = [getattr(cls, "message_{}".format(i), None) for i in range(OPCODE_COUNT)]
+            extensions = [getattr(cls, "message_61_{}".format(i), None) for i in range(OPCODE_COUNT)]
+            tables = (opcodes, extensions)
+            setattr(cls, "_dispatchTables", tables)
+        return tables
     
     def generateLookups(self):
+        #Bind the class tables to this instance, instance attributes such as
+        #self.message_8 = handler take priority over the class methods.
+        opcodes, extensions = self._classDispatch()
+        instance = self.__dict__
+        self.handlers = [
+            instance.get("message_{}".format(i)) or (f.__get__(self) if f else self.message_unhandled)
+            for i, f in enumerate(opcodes)
+        ]
+        self.handlers61 = [
+            instance.get("message_61_{}".format(i)) or (f.__get__(self) if f else self.message_61_unhandled)
+            for i, f in enumerate(extensions)
+        ]
+        
         self.lookup = {}
-        for entry in dir(self):
-            if entry.startswith("message_"):
-                try:
-                    n = entry.split("_")[1:]
-                    if len(n) == 1:
-                        n = int(n[0])
-                    else:
-                        n = (int(n[0]), int(n[1]))
-                    self.lookup[n] = getattr(self, entry)
-                except ValueError:
-                    pass
+        for i, f in enumerate(opcodes):
+            if f or "message_{}".format(i) in instance:
+                self.lookup[i] = self.handlers[i]
+        for i, f in enumerate(extensions):
+            if f or "message_61_{}".format(i) in instance:
+                self.lookup[(61, i)] = self.handlers61[i]
+        
+        self.updateSubscriptions()
+    
+    def updateSubscriptions(self):
+        #Called by on/hook/off. If you edit self.listeners directly, call
+        #this afterwards or packets for the new names may not be decoded.
+        self.subscribed = set(name for name, callbacks in self.listeners.items() if callbacks)
+        everything = "*" in self.subscribed
+        self.fireRaw = everything or "Raw" in self.subscribed
+        
+        #A None entry means nobody will receive what the handler fires, so
+        #the packet is dropped without being decoded. Handlers that don't
+        #declare their events with @fires always run.
+        def wanted(handler):
+            events = getattr(handler, "fires", None)
+            if everything or events == None or not events.isdisjoint(self.subscribed):
+                return handler
+            return None
+        
+        self.dispatch = [wanted(handler) for handler in self.handlers]
+        self.dispatch61 = [wanted(handler) for handler in self.handlers61]
+    
+    def __setattr__(self, name, value):
+        super().__setattr__(name, value)
+        #Registering a handler on the instance updates the dispatch tables
+        if name.startswith("message_") and "dispatch61" in self.__dict__:
+            self.generateLookups()
+    
+    def __delattr__(self, name):
+        super().__delattr__(name)
+        if name.startswith("message_") and "dispatch61" in self.__dict__:
+            self.generateLookups()
     
     #Messages
     #" " - Remove avatar by ID
+    @fires("RemoveAvatarID")
     async def message_0(self, opcode, data):
         msg = FurcBuffer(data)
         fuid = msg.read220(4)
         await self.fire("RemoveAvatarID", fuid)
     
     #"!" - Sound
+    @fires("Sound")
     async def message_1(self, opcode, data):
         msg = FurcBuffer(data)
         soundID = msg.read95(2)
         await self.fire("Sound", soundID)
     
     #"%" - Standing on object
+    @fires("ButlerFeet")
     async def message_5(self, opcode, data):
         msg = FurcBuffer(data)
         itemID = msg.read95(2)
         await self.fire("ButlerFeet", itemID)
     
     #"&" - Login success
+    @fires("Login")
     async def message_6(self, opcode, data):
         await self.fire("Login", True)
     
     #"(" - Text message
+    @fires("Message")
     async def message_8(self, opcode, data):
         await self.fire("Message", data)
     
     #")" - Remove avatar
+    @fires("RemoveAvatar")
     async def message_9(self, opcode, data):
         msg = FurcBuffer(data)
         fuid = msg.read220(4)
         await self.fire("RemoveAvatar", fuid)
     
     #"/" - Animate avatar
+    @fires("AnimateAvatar")
     async def message_15(self, opcode, data):
         msg = FurcBuffer(data)
         fuid = msg.read220(4)
@@ -84,6 +169,7 @@ class PacketHooks(DefaultPacketHandler):
         await self.fire("AnimateAvatar", fuid, (x,y), direction, shape)
     
     #"0" - Set variables
+    @fires("SetVariables")
     async def message_16(self, opcode, data):
         msg = FurcBuffer(data)
         variables = {}
@@ -103,49 +189,17 @@ class PacketHooks(DefaultPacketHandler):
         await self.fire("SetVariables", variables)
     
     #"1" - Set floors
+    @fires("SetFloor")
     async def message_17(self, opcode, data):
-        msg = FurcBuffer(data)
-        result = []
-        while msg.remaining >= 6:
-            x = msg.read220(2)
-            y = msg.read220(2)
-            floorID = msg.read220(2)
-            
-            #Decode repeats
-            repeats = 48 * math.floor(x / 1000) + math.floor(y / 1000)
-            x = x % 1000
-            y = y % 1000
-            
-            result.append({
-                "pos": (x, y),
-                "id": floorID,
-                "repeats": repeats
-            })
-        
-        await self.fire("SetFloor", result)
+        await self.fire("SetFloor", TileUpdates.fromRecords(data))
     
     #"2" - Set walls
+    @fires("SetWall")
     async def message_18(self, opcode, data):
-        msg = FurcBuffer(data)
-        result = []
-        while msg.remaining >= 6:
-            x = msg.read220(2)
-            y = msg.read220(2)
-            wallID = msg.read220(2)
-            
-            #Decode repeats
-            repeats = 48 * math.floor(x / 1000) + math.floor(y / 1000)
-            x = x % 1000
-            y = y % 1000
-            
-            result.append({
-                "pos": (x, y),
-                "id": wallID,
-                "repeats": repeats
-            })
-        await self.fire("SetWall", result)
+        await self.fire("SetWall", TileUpdates.fromRecords(data))
     
     #"3" - Set DS Variable stack
+    @fires("DSVariableStack")
     async def message_19(self, opcode, data):
         msg = FurcBuffer(data)
         vals = []
@@ -155,6 +209,7 @@ class PacketHooks(DefaultPacketHandler):
         await self.fire("DSVariableStack", vals)
     
     #"4" - Set region
+    @fires("SetRegion")
     async def message_20(self, opcode, data):
         msg = FurcBuffer(data)
         result = []
@@ -162,80 +217,44 @@ class PacketHooks(DefaultPacketHandler):
             x = msg.read220(2)
             y = msg.read220(2)
             regionID = msg.read220(2)
-            result.append({
-                "pos": (x, y),
-                "id": regionID
-            })
+            result.append(events.SetRegionEntry((x, y), regionID))
         await self.fire("SetRegion", result)
     
     #"5" - Set effect
+    @fires("SetEffect")
     async def message_21(self, opcode, data):
-        msg = FurcBuffer(data)
-        result = []
-        while msg.remaining >= 6:
-            x = msg.read220(2)
-            y = msg.read220(2)
-            effectID = msg.read220(2)
-            
-            #Decode repeats
-            repeats = 48 * math.floor(x / 1000) + math.floor(y / 1000)
-            x = x % 1000
-            y = y % 1000
-            
-            result.append({
-                "pos": (x, y),
-                "id": effectID,
-                "repeats": repeats
-            })
-        await self.fire("SetEffect", result)
+        await self.fire("SetEffect", TileUpdates.fromRecords(data))
     
     #"6" - DS event triggered by player
+    @fires("DSEvent")
     async def message_22(self, opcode, data):
         msg = FurcBuffer(data)
-        from_x = msg.read95(2)
-        from_y = msg.read95(2)
-        to_x = msg.read95(2)
-        to_y = msg.read95(2)
+        source = (msg.read95(2), msg.read95(2))
+        to = (msg.read95(2), msg.read95(2))
         while msg.remaining >= 6:
             line = msg.read95(2)
             if line > 8000:
                 line = line - 8000 + (msg.read95(2) * 1000)
             
-            extra_x = msg.read95(2)
-            extra_y = msg.read95(2)
-            
-            result = {
-                "from": (from_x, from_y),
-                "to": (to_x, to_y),
-                "extra": (extra_x, extra_y),
-                "line": line
-            }
-            await self.fire("DSEvent", True, result)
+            extra = (msg.read95(2), msg.read95(2))
+            await self.fire("DSEvent", True, events.DSTrigger(source, to, extra, line))
     
     #"7" - DS event triggered by other
+    @fires("DSEvent")
     async def message_23(self, opcode, data):
         msg = FurcBuffer(data)
-        from_x = msg.read95(2)
-        from_y = msg.read95(2)
-        to_x = msg.read95(2)
-        to_y = msg.read95(2)
+        source = (msg.read95(2), msg.read95(2))
+        to = (msg.read95(2), msg.read95(2))
         while msg.remaining >= 8:
             line = msg.read95(2)
             if line > 8000:
                 line = line - 8000 + (msg.read95(2) * 1000)
             
-            extra_x = msg.read95(2)
-            extra_y = msg.read95(2)
-        
-            result = {
-                "from": (from_x, from_y),
-                "to": (to_x, to_y),
-                "extra": (extra_x, extra_y),
-                "line": line
-            }
-            await self.fire("DSEvent", False, result)
+            extra = (msg.read95(2), msg.read95(2))
+            await self.fire("DSEvent", False, events.DSTrigger(source, to, extra, line))
     
     #"8" - DS event addon
+    @fires("DSEventAddon")
     async def message_24(self, opcode, data):
         msg = FurcBuffer(data)
         moveFlag = msg.read95(1)
@@ -269,29 +288,14 @@ class PacketHooks(DefaultPacketHandler):
         month = msg.read95(1)
         year = msg.read95(2)
         portalClose = (msg.read95(2), msg.read95(2))
-        await self.fire("DSEventAddon", {
-            "moveFlag": moveFlag,
-            "randSeed": randSeed,
-            "saidNum": saidNum,
-            "facingDir": facingDir,
-            "entryCode": entryCode,
-            "objPaws": objPaws,
-            "furreCount": furreCount,
-            "userID": userID,
-            "DSBtn": DSBtn,
-            "dreamCookies": dreamCookies,
-            "triggererCookies": triggererCookies,
-            "portalOpen": portalOpen,
-            "second": second,
-            "minute": minute,
-            "hour": hour,
-            "day": day,
-            "month": month,
-            "year": year,
-            "portalClose": portalClose
-        })
+        await self.fire("DSEventAddon", events.DSEventAddon(
+            moveFlag, randSeed, saidNum, facingDir, entryCode, objPaws,
+            furreCount, userID, DSBtn, dreamCookies, triggererCookies,
+            portalOpen, second, minute, hour, day, month, year, portalClose
+        ))
     
     #"9" - Region flags
+    @fires("RegionFlags")
     async def message_25(self, opcode, data):
         msg = FurcBuffer(data)
         regions = {}
@@ -305,10 +309,12 @@ class PacketHooks(DefaultPacketHandler):
         await self.fire("RegionFlags", regions)
     
     #";" - Load map
+    @fires("LoadMap")
     async def message_27(self, opcode, data):
         await self.fire("LoadMap", data.decode())
     
     #"<" - Spawn avatar
+    @fires("SpawnAvatar")
     async def message_28(self, opcode, data):
         msg = FurcBuffer(data)
         fuid = msg.read220(4)
@@ -325,46 +331,27 @@ class PacketHooks(DefaultPacketHandler):
         await self.fire("SpawnAvatar", fuid, (x,y), direction, shape, name, colors, flags, afkTime, scale)
     
     #"=" - Resume drawing
+    @fires("Suspend")
     async def message_29(self, opcode, data):
         await self.fire("Suspend", False)
     
     #">" - Spawn object
+    @fires("SetObject")
     async def message_30(self, opcode, data):
-        msg = FurcBuffer(data)
-        result = []
-        while msg.remaining >= 6:
-            x = msg.read220(2)
-            y = msg.read220(2)
-            objectID = msg.read220(2)
-            
-            #Decode repeats
-            repeats = 48 * math.floor(x / 1000) + math.floor(y / 1000)
-            x = x % 1000
-            y = y % 1000
-            
-            result.append({
-                "pos": (x, y),
-                "id": objectID,
-                "repeats": repeats
-            })
-        
-        await self.fire("SetObject", result)
+        await self.fire("SetObject", TileUpdates.fromRecords(data))
     
     #"@" - Move camera
+    @fires("MoveCamera")
     async def message_32(self, opcode, data):
         msg = FurcBuffer(data)
-        x = msg.read95(2)
-        y = msg.read95(2)
-        result = {
-            "to": (x, y)
-        }
+        to = (msg.read95(2), msg.read95(2))
+        source = None
         if msg.remaining >= 4:
-            x = msg.read95(2)
-            y = msg.read95(2)
-            result["from"] = (x, y)
-        await self.fire("MoveCamera", result)
+            source = (msg.read95(2), msg.read95(2))
+        await self.fire("MoveCamera", events.CameraMove(to, source))
     
     #"A" - Move avatars
+    @fires("MoveAvatar")
     async def message_33(self, opcode, data):
         msg = FurcBuffer(data)
         fuid = msg.read220(4)
@@ -375,6 +362,7 @@ class PacketHooks(DefaultPacketHandler):
         await self.fire("MoveAvatar", fuid, (x,y), direction, shape)
     
     #"B" - Set avatar colors
+    @fires("SetAvatarColors")
     async def message_34(self, opcode, data):
         msg = FurcBuffer(data)
         furre = msg.read220(4)
@@ -384,6 +372,7 @@ class PacketHooks(DefaultPacketHandler):
         await self.fire("SetAvatarColors", furre, direction, shape, colors)
     
     #"C" - Hide avatar at position
+    @fires("HideAvatar")
     async def message_35(self, opcode, data):
         msg = FurcBuffer(data)
         furre = msg.read220(4)
@@ -391,6 +380,7 @@ class PacketHooks(DefaultPacketHandler):
         await self.fire("HideAvatar", furre, pos)
     
     #"D" - Announce furre presence
+    @fires("FurreArrive")
     async def message_36(self, opcode, data):
         msg = FurcBuffer(data)
         fuid = msg.read220(4)
@@ -407,54 +397,22 @@ class PacketHooks(DefaultPacketHandler):
         await self.fire("FurreArrive", fuid, (x, y), direction, shape, unk1, unk2, unk3, unk4)
     
     #"E" - Spawn SFX
+    @fires("SetSFX")
     async def message_37(self, opcode, data):
-        msg = FurcBuffer(data)
-        result = []
-        while msg.remaining >= 6:
-            x = msg.read220(2)
-            y = msg.read220(2)
-            fxID = msg.read220(2)
-            
-            #Decode repeats
-            repeats = 48 * math.floor(x / 1000) + math.floor(y / 1000)
-            x = x % 1000
-            y = y % 1000
-            
-            result.append({
-                "pos": (x, y),
-                "id": fxID,
-                "repeats": repeats
-            })
-        
-        await self.fire("SetSFX", result)
+        await self.fire("SetSFX", TileUpdates.fromRecords(data))
     
     #"F" - Spawn Ambient
+    @fires("SetAmbient")
     async def message_38(self, opcode, data):
-        msg = FurcBuffer(data)
-        result = []
-        while msg.remaining >= 6:
-            x = msg.read220(2)
-            y = msg.read220(2)
-            ambientID = msg.read220(2)
-            
-            #Decode repeats
-            repeats = 48 * math.floor(x / 1000) + math.floor(y / 1000)
-            x = x % 1000
-            y = y % 1000
-            
-            result.append({
-                "pos": (x, y),
-                "id": ambientID,
-                "repeats": repeats
-            })
-        
-        await self.fire("SetAmbient", result)
+        await self.fire("SetAmbient", TileUpdates.fromRecords(data))
     
     #"[" - Disconnected (Reconnect allowed)
+    @fires("Disconnect")
     async def message_59(self, opcode, data):
         await self.fire("Disconnect", data.decode())
     
     #"\" - Server authenticate
+    @fires("Authenticate")
     async def message_60(self, opcode, data):
         await self.fire("Authenticate", data.decode())
     
@@ -462,17 +420,21 @@ class PacketHooks(DefaultPacketHandler):
     async def message_61(self, opcode, data):
         if len(data) < 2:
             return
-        await getattr(
-            self,
-            "message_61_" + str(data[0]-32),
-            self.message_61_unhandled
-        )(data[0]-32, data[1:])
+        subop = data[0] - 32
+        if 0 <= subop < OPCODE_COUNT:
+            handler = self.dispatch61[subop]
+            if handler == None:
+                return
+        else:
+            handler = self.message_61_unhandled
+        await handler(subop, data[1:])
     
     #Default handler
     async def message_61_unhandled(self, opcode, data):
         logging.error("Unhandled 61:{}".format(opcode), data)
     
     #"]!" - Adult warning
+    @fires("MaturityWarning")
     async def message_61_1(self, opcode, data):
         maturity = data.decode()
         parental = False
@@ -483,6 +445,7 @@ class PacketHooks(DefaultPacketHandler):
         await self.fire("MaturityWarning", parental, maturity)
     
     #"]#" - Dialog
+    @fires("Dialog")
     async def message_61_3(self, opcode, data):
         msg = FurcBuffer(data)
         dialogID = msg.readUntil().decode()
@@ -497,12 +460,14 @@ class PacketHooks(DefaultPacketHandler):
         await self.fire("Dialog", dialogID, dialogType, dialogMessage)
     
     #"]$" - Open URL
+    @fires("OpenURL")
     async def message_61_4(self, opcode, data):
         msg = FurcBuffer(data)
         url = msg.readUntil()
         await self.fire("OpenURL", False, url)
     
     #"]%" - Online reply
+    @fires("OnlineStatus")
     async def message_61_5(self, opcode, data):
         msg = FurcBuffer(data)
         online = bool(int(msg.read(1)))
@@ -510,6 +475,7 @@ class PacketHooks(DefaultPacketHandler):
         await self.fire("OnlineStatus", online, name)
     
     #"]&" - Set portrait
+    @fires("Portrait")
     async def message_61_6(self, opcode, data):
         msg = FurcBuffer(data)
         pid = int(msg.readUntil().decode())
@@ -517,10 +483,12 @@ class PacketHooks(DefaultPacketHandler):
         await self.fire("Portrait", pid, name)
     
     #"]*" - Show URL
+    @fires("OpenURL")
     async def message_61_10(self, opcode, data):
         await self.fire("OpenURL", True, data)
     
     #"]+" - Set last profile ID (DEPRECATED)
+    @fires("LastProfileID")
     async def message_61_11(self, opcode, data):
         msg = FurcBuffer(data)
         pid = int(msg.readUntil().decode())
@@ -529,10 +497,12 @@ class PacketHooks(DefaultPacketHandler):
         await self.fire("LastProfileID", pid)
     
     #"]-" - Prefix text, used by say command (Can be overridden by 61_48)
+    @fires("PrefixBadge")
     async def message_61_13(self, opcode, data):
         await self.fire("PrefixBadge", data)
     
     #"]3" - Show user list
+    @fires("EnableUserList")
     async def message_61_19(self, opcode, data):
         msg = FurcBuffer(data)
         #0 = Show usercount + list, 1 = Only count
@@ -540,6 +510,7 @@ class PacketHooks(DefaultPacketHandler):
         await self.fire("EnableUserList", enabled)
     
     #"]?" - Pounce
+    @fires("PounceInit", "PounceList", "PounceUpdate")
     async def message_61_31(self, opcode, data):
         msg = FurcBuffer(data)
         subop = msg.read(1)
@@ -558,16 +529,16 @@ class PacketHooks(DefaultPacketHandler):
                     if 1 and 2 are unset, then we sent the FR and they haven't accepted
                     if 1 is set and 2 is unset, then they sent the FR and we haven't accepted
                 """
-                entry = {
-                    "character": msg.read220(4), #our FUID
-                    "fuid": msg.read220(4), #their FUID
-                    "status": msg.read(1), #+ = online, - = offline
-                    "unk4": datetime.datetime.fromtimestamp(msg.read220(4) + 1505145789), #Magic numbers yay!
-                    "unk5": datetime.datetime.fromtimestamp(msg.read220(4) + 1505145789),
-                    "unk6": datetime.datetime.fromtimestamp(msg.read220(4) + 1505145789),
-                    "flags": msg.read220(1),
-                    "name": msg.read(msg.read220(1))
-                }
+                entry = events.PounceEntry(
+                    msg.read220(4), #our FUID
+                    msg.read220(4), #their FUID
+                    msg.read(1), #+ = online, - = offline
+                    datetime.datetime.fromtimestamp(msg.read220(4) + 1505145789), #Magic numbers yay!
+                    datetime.datetime.fromtimestamp(msg.read220(4) + 1505145789),
+                    datetime.datetime.fromtimestamp(msg.read220(4) + 1505145789),
+                    msg.read220(1), #flags
+                    msg.read(msg.read220(1)) #name
+                )
                 pounceList.append(entry)
             
             await self.fire("PounceList", pounceList)
@@ -587,10 +558,10 @@ class PacketHooks(DefaultPacketHandler):
         elif subop == "o":
             onlineList = []
             while msg.remaining >= 5: #Greater or equal to since no unknown length
-                entry = {
-                    "fuid": msg.read220(4),
-                    "status": msg.read(1) #+ = online, - = offline
-                }
+                entry = events.PounceStatus(
+                    msg.read220(4),
+                    msg.read(1) #+ = online, - = offline
+                )
                 onlineList.append(entry)
             
             await self.fire("PounceUpdate", onlineList)
@@ -599,6 +570,7 @@ class PacketHooks(DefaultPacketHandler):
             logging.warn("Received unknown 61:31 (Pounce) request from server!")
     
     #"]A" - Download guild tag command (DEPRECATED?)
+    @fires("GuildTagDownload")
     async def message_61_33(self, opcode, data):
         msg = FurcBuffer(data)
         checksum = int(msg.readUntil()) #Download it from file server using gt%i
@@ -606,6 +578,7 @@ class PacketHooks(DefaultPacketHandler):
         await self.fire("GuildTagDownload", checksum, name)
     
     #"]B" - Set user ID
+    @fires("SetUserID")
     async def message_61_34(self, opcode, data):
         msg = FurcBuffer(data)
         fuid = int(msg.readUntil())
@@ -613,6 +586,7 @@ class PacketHooks(DefaultPacketHandler):
         await self.fire("SetUserID", fuid, username)
     
     #"]C" - Bookmark Dream
+    @fires("Bookmark")
     async def message_61_35(self, opcode, data):
         msg = FurcBuffer(data)
         msg = FurcBuffer(data)
@@ -621,21 +595,25 @@ class PacketHooks(DefaultPacketHandler):
         await self.fire("Bookmark", temporary, fdl)
     
     #"]D" - Begin share edit
+    @fires("LiveEdit")
     async def message_61_36(self, opcode, data):
         #Activate, Is Owner
         await self.fire("LiveEdit", True, False)
     
     #"]E" - Begin share edit
+    @fires("LiveEdit")
     async def message_61_37(self, opcode, data):
         #Activate, Is Owner
         await self.fire("LiveEdit", True, True)
     
     #"]F" - Begin share edit
+    @fires("LiveEdit")
     async def message_61_38(self, opcode, data):
         #Activate, Is Owner
         await self.fire("LiveEdit", False, False)
     
     #"]G" - Disable tab key
+    @fires("DisableTab")
     async def message_61_39(self, opcode, data):
         #0 = Enable, 1 = Disable
         msg = FurcBuffer(data)
@@ -643,6 +621,7 @@ class PacketHooks(DefaultPacketHandler):
         await self.fire("DisableTab", disabled)
     
     #"]H" - Offset avatar
+    @fires("OffsetAvatar")
     async def message_61_40(self, opcode, data):
         msg = FurcBuffer(data)
         fuid = msg.read220(4)
@@ -651,6 +630,7 @@ class PacketHooks(DefaultPacketHandler):
         await self.fire("OffsetAvatar", fuid, (x, y))
     
     #"]I" - Particle Effect
+    @fires("Particles")
     async def message_61_41(self, opcode, data):
         msg = FurcBuffer(data)
         x = msg.read220(2)
@@ -661,6 +641,7 @@ class PacketHooks(DefaultPacketHandler):
         await self.fire("Particles", (x, y), (offset_x, offset_y), particles)
     
     #"]J" - Web map
+    @fires("WebMap")
     async def message_61_42(self, opcode, data):
         await self.fire("WebMap", data)
     
@@ -669,6 +650,7 @@ class PacketHooks(DefaultPacketHandler):
         pass
     
     #"]M" - Dynamic Avatars Info
+    @fires("DynamicAvatars")
     async def message_61_45(self, opcode, data):
         avatars = {}
         msg = FurcBuffer(data)
@@ -686,21 +668,19 @@ class PacketHooks(DefaultPacketHandler):
                 
                 updated = msg.read220(4)
                 
-                avatars[avatarId] = {
-                    "version": avatarVersion,
-                    "flags": flags,
-                    "updated": updated
-                }
+                avatars[avatarId] = events.DynamicAvatar(avatarVersion, flags, updated)
         
         await self.fire("DynamicAvatars", avatars)
     
     #"]N" - Show pounce channel list
+    @fires("ShowPounceChannels")
     async def message_61_46(self, opcode, data):
         msg = FurcBuffer(data)
         showPounceChannels = bool(int(msg.read(1)))
         await self.fire("ShowPounceChannels", showPounceChannels)
     
     #"]O" - Gloam
+    @fires("Gloam")
     async def message_61_47(self, opcode, data):
         msg = FurcBuffer(data)
         result = {}
@@ -718,18 +698,17 @@ class PacketHooks(DefaultPacketHandler):
             
             intensity = msg.read220(2) & 0xFF #0 to 254
             
-            result[fuid] = {
-                "color": [r, g, b],
-                "intensity": intensity
-            }
+            result[fuid] = events.GloamLight((r, g, b), intensity)
         
         await self.fire("Gloam", result)
     
     #"]P" - Prefix next line (Can be overridden by 61_13)
+    @fires("PrefixLine")
     async def message_61_48(self, opcode, data):
         await self.fire("PrefixLine", data)
     
     #"]S" - Connection security info
+    @fires("ConnectionSecurity")
     async def message_61_51(self, opcode, data):
         msg = FurcBuffer(data)
         #0 = insecure, 1 = unk, 2 = unused, 3 = secure
@@ -738,44 +717,33 @@ class PacketHooks(DefaultPacketHandler):
     
     #"]W" - Region settings
     #FIXME: Resolve unknown variables
+    @fires("RegionSettings")
     async def message_61_55(self, opcode, data):
         msg = FurcBuffer(data)
-        result = {
-            "outdoor": {
-                "object": msg.read220(2),
-                "wall": msg.read220(2),
-                "floor": msg.read220(2),
-                "effect": msg.read220(2),
-            },
-            "indoor": {
-                "object": msg.read220(2),
-                "wall": msg.read220(2),
-                "floor": msg.read220(2),
-                "effect": msg.read220(2),
-            },
-            "unk1": msg.read220(2),
-            "walls": {
-                "bottom": msg.read220(1),
-                "top": msg.read220(1),
-            },
-            "unk2": msg.read220(2),
-            "unk3": msg.read220(2),
-            "unk4": msg.read220(2),
-            "unk5": msg.read220(2),
-            "unk6": []
-        }
+        outdoor = events.RegionDefaults(msg.read220(2), msg.read220(2), msg.read220(2), msg.read220(2))
+        indoor = events.RegionDefaults(msg.read220(2), msg.read220(2), msg.read220(2), msg.read220(2))
+        unk1 = msg.read220(2)
+        walls = events.WallHeights(msg.read220(1), msg.read220(1))
+        unk2 = msg.read220(2)
+        unk3 = msg.read220(2)
+        unk4 = msg.read220(2)
+        unk5 = msg.read220(2)
+        unk6 = []
         
         while msg.remaining >= 4:
             l = msg.read220(1)
             for i in range(l):
-                result["unk6"].append((
+                unk6.append((
                     msg.read220(2),
                     msg.read220(1),
                 ))
         
-        await self.fire("RegionSettings", result)
+        await self.fire("RegionSettings", events.RegionSettings(
+            outdoor, indoor, unk1, walls, unk2, unk3, unk4, unk5, unk6
+        ))
     
     #"]Z" - Art party(?)
+    @fires("ArtPartyEnd", "ArtPartyDraw", "ArtPartySetShape", "ArtPartyRequest", "ArtPartyStart")
     async def message_61_58(self, opcode, data):
         msg = FurcBuffer(data)
         cmd = int(msg.read(1))
@@ -790,13 +758,9 @@ class PacketHooks(DefaultPacketHandler):
                 pixelColor = pxPosB & 0xFF
                 pixelPos = pxPosA + ((pxPosB >> 8) * 0x8000) - 256
                 unk = msg.read220(2)
-                pixels.append({
-                    "pixel": pixelPos,
-                    "color": pixelColor,
-                    "unk": unk,
-                    "x": pixelPos & 0xFF,
-                    "y": 0xFE - (pixelPos >> 8)
-                })
+                pixels.append(events.ArtPixel(
+                    pixelPos, pixelColor, unk, pixelPos & 0xFF, 0xFE - (pixelPos >> 8)
+                ))
             
             await self.fire("ArtPartyDraw", pixels)
         
@@ -813,10 +777,12 @@ class PacketHooks(DefaultPacketHandler):
             logging.warn("Received unknown 61:58 (Art Party) request from server!")
     
     #"]]" - Login failure
+    @fires("Login")
     async def message_61_61(self, opcode, data):
         await self.fire("Login", False)
     
     #"]_" - Kitterdust
+    @fires("KitterDust")
     async def message_61_63(self, opcode, data):
         msg = FurcBuffer(data)
         avatars = {}
@@ -825,6 +791,7 @@ class PacketHooks(DefaultPacketHandler):
         await self.fire("KitterDust", avatars)
     
     #"]`" - Load remote config
+    @fires("RemoteConfig")
     async def message_61_64(self, opcode, data):
         msg = FurcBuffer(data)
         subop = msg.read(1)
@@ -852,6 +819,7 @@ class PacketHooks(DefaultPacketHandler):
         logging.warn("Received deprecated 61:65 (Upload dream request) from server!")
     
     #"]b" - Resize map
+    @fires("DreamResize")
     async def message_61_64(self, opcode, data):
         msg = FurcBuffer(data)
         x = msg.read95(2)
@@ -859,6 +827,7 @@ class PacketHooks(DefaultPacketHandler):
         await self.fire("DreamResize", (x, y))
     
     #"]c" - Set marbled
+    @fires("Marbled")
     async def message_61_67(self, opcode, data):
         #This has a "c" prefixed to it
         msg = FurcBuffer(data)
@@ -892,6 +861,7 @@ class PacketHooks(DefaultPacketHandler):
         logging.warn("Received deprecated 61:69 (Unknown) from server!")
     
     #"]f" - Look
+    @fires("Look")
     async def message_61_70(self, opcode, data):
         msg = FurcBuffer(data)
         colors = Colors.fromStream(msg, False)
@@ -899,12 +869,14 @@ class PacketHooks(DefaultPacketHandler):
         await self.fire("Look", colors, name)
     
     #"]g" - Execute binary (lmao) (DEPRECATED)
+    @fires("Execute")
     async def message_61_71(self, opcode, data):
         msg = FurcBuffer(data)
         command = msg.read()
         await self.fire("Execute", command, False)
     
     #"]h" - Execute binary and close (lmao)
+    @fires("Execute")
     async def message_61_72(self, opcode, data):
         msg = FurcBuffer(data)
         command = msg.read()
@@ -920,18 +892,21 @@ class PacketHooks(DefaultPacketHandler):
         logging.warn("Received deprecated 61:73 (Create file) from server!")
     
     #"]j" - Music
+    @fires("Music")
     async def message_61_74(self, opcode, data):
         msg = FurcBuffer(data)
         musicID = msg.read95(2)
         await self.fire("Music", musicID)
     
     #"]k" - Set file server
+    @fires("SetFileServer")
     async def message_61_75(self, opcode, data):
         msg = FurcBuffer(data)
         serverID = msg.read95(1)
         await self.fire("SetFileServer", serverID)
     
     #"]m" - Marco
+    @fires("Marco")
     async def message_61_77(self, opcode, data):
         msg = FurcBuffer(data)
         msg.readUntil() #Skip space
@@ -939,6 +914,7 @@ class PacketHooks(DefaultPacketHandler):
         await self.fire("Marco", polon)
     
     #"]n" - Channel info(?)
+    @fires("ChannelInfo")
     async def message_61_78(self, opcode, data):
         msg = FurcBuffer(data)
         version = msg.read220(1)
@@ -958,12 +934,14 @@ class PacketHooks(DefaultPacketHandler):
             await self.fire("ChannelInfo", channelUpdateType == "@", name, maturity, peopleCount, canTell, canListen, canBroadcast, channelImage)
     
     #"]o" - Dream owner name
+    @fires("DreamOwner")
     async def message_61_79(self, opcode, data):
         msg = FurcBuffer(data)
         owner = msg.read()
         await self.fire("DreamOwner", owner.decode())
     
     #"]q" - Load dream with custom patches
+    @fires("Dream")
     async def message_61_81(self, opcode, data):
         msg = FurcBuffer(data)
         msg.readUntil() #NOP
@@ -979,6 +957,7 @@ class PacketHooks(DefaultPacketHandler):
         await self.fire("Dream", True, patchName, crc32, modern)
     
     #"]r" - Load dream with default patches
+    @fires("Dream")
     async def message_61_82(self, opcode, data):
         msg = FurcBuffer(data)
         msg.readUntil() #NOP
@@ -987,6 +966,7 @@ class PacketHooks(DefaultPacketHandler):
         await self.fire("Dream", False, patchName, crc32, False)
     
     #"]s" - Place text at location
+    @fires("Text")
     async def message_61_83(self, opcode, data):
         msg = FurcBuffer(data)
         x = msg.read95(2)
@@ -999,6 +979,7 @@ class PacketHooks(DefaultPacketHandler):
         await self.fire("Text", (x, y), textType, name, title, maturity, gateType)
     
     #"]t" - Clear text at location
+    @fires("ClearText")
     async def message_61_84(self, opcode, data):
         msg = FurcBuffer(data)
         x = msg.read95(2)
@@ -1007,10 +988,12 @@ class PacketHooks(DefaultPacketHandler):
     
     #"]u" - Waiting for dream
     #FIXME: Has a string parameter like 0_11, find out what this does
+    @fires("UploadReady")
     async def message_61_85(self, opcode, data):
         await self.fire("UploadReady")
     
     #"]v" - Effect
+    @fires("Effect")
     async def message_61_86(self, opcode, data):
         msg = FurcBuffer(data)
         #Known types:
@@ -1027,53 +1010,66 @@ class PacketHooks(DefaultPacketHandler):
         )
     
     #"]w" - Version request
+    @fires("VersionReq")
     async def message_61_87(self, opcode, data):
         await self.fire("VersionReq")
     
     #"]x" - Client should update
+    @fires("Update")
     async def message_61_88(self, opcode, data):
         await self.fire("Update")
     
     #"]y" - Changing IP/port
+    @fires("Update")
     async def message_61_89(self, opcode, data):
         await self.fire("Update", data)
     
     #"]z" - UID response
+    @fires("UID")
     async def message_61_90(self, opcode, data):
         msg = FurcBuffer(data)
         fuid = int(msg.readUntil())
         await self.fire("UID", fuid)
     
     #"]{" - Session ID
+    @fires("SessionID")
     async def message_61_91(self, opcode, data):
         msg = FurcBuffer(data)
         sessionID = int(msg.readUntil())
         await self.fire("SessionID", sessionID)
     
     #"]|" - Flip screen
+    @fires("FlipScreen")
     async def message_61_92(self, opcode, data):
         msg = FurcBuffer(data)
         flip = msg.read(1) == 49
         await self.fire("FlipScreen", flip)
     
     #"]}" - Set own colors
+    @fires("SetColors")
     async def message_61_93(self, opcode, data):
         msg = FurcBuffer(data)
         colors = Colors.fromStream(msg)
         await self.fire("SetColors", colors)
     
     #"^" - Item in hand
+    @fires("ButlerPaws")
     async def message_62(self, opcode, data):
         msg = FurcBuffer(data)
         item = msg.read95(2)
         await self.fire("ButlerPaws", item)
     
     #"~" - Suspend drawing
+    @fires("Suspend")
     async def message_94(self, opcode, data):
         await self.fire("Suspend", True)
     
     #Hook definitions
     async def fire(self, name, *args, **kwargs):
+        metrics = self.metrics
+        if metrics != None:
+            start = time.perf_counter()
+        
         if name in self.listeners:
             for callback in self.listeners[name]:
                 await callback(*args, **kwargs)
@@ -1081,40 +1077,117 @@ class PacketHooks(DefaultPacketHandler):
         for callback in self.listeners["*"]:
             await callback(name, *args, **kwargs)
         
+        if metrics != None:
+            elapsed = time.perf_counter() - start
+            metrics.listenerTime += elapsed
+            metrics.observe("furc_listener_seconds", (("event", name),), elapsed)
         return True
     
     def on(self, name, *args, **kwargs):
         def _(func):
-            if name not in self.listeners:
-                self.listeners[name] = []
-            self.listeners[name].append(func)
+            self.hook(name, func, *args, **kwargs)
             return func
         return _
     
-    def hook(self, name, func):
+    def hook(self, name, func, policy = Listener.INLINE, queueSize = 256,
+             overflow = Listener.BLOCK):
+        """
+            Listen for an event. policy is one of Listener.INLINE (awaited in
+            order by fire), Listener.TASK (detached) or Listener.QUEUE (run
+            by a worker with a queue of queueSize, see Listener for the
+            overflow options). Returns the Listener.
+        """
         if name not in self.listeners:
             self.listeners[name] = []
-        self.listeners[name].append(func)
+        listener = Listener(self, name, func, policy, queueSize, overflow)
+        self.listeners[name].append(listener)
+        self.updateSubscriptions()
+        return listener
     
     def off(self, name, func):
         if name not in self.listeners:
             return
-        self.listeners[name].remove(func)
+        listeners = self.listeners[name]
+        listener = listeners[listeners.index(func)]
+        listeners.remove(func)
+        if isinstance(listener, Listener):
+            listener.close()
+        self.updateSubscriptions()
+    
+    def setPriority(self, name, priority):
+        self.eventPriority[name] = priority
+    
+    async def flushListeners(self):
+        #Wait for detached and queued listeners to catch up
+        for listeners in list(self.listeners.values()):
+            for listener in list(listeners):
+                if isinstance(listener, Listener):
+                    await listener.join()
+    
+    def listenerStats(self):
+        result = []
+        for listeners in self.listeners.values():
+            for listener in listeners:
+                if isinstance(listener, Listener):
+                    result.append(listener.stats())
+        return result
+    
+    #Instrumentation
+    def instrument(self, *sinks):
+        """
+            Start recording metrics into sinks, a MemorySink if none are
+            given. See libfurc.metrics.Metrics for what is recorded.
+        """
+        self.metrics = Metrics(*(sinks or (MemorySink(),)))
+        self.handlePacket = self.handlePacketMeasured
+        if self.measureLogin not in self.listeners.get("Login", ()):
+            self.hook("Login", self.measureLogin)
+        return self.metrics
+    
+    def uninstrument(self):
+        self.metrics = None
+        if "handlePacket" in self.__dict__:
+            del self.handlePacket
+    
+    async def measureLogin(self, success):
+        if self.metrics != None and self.loginSent != None:
+            self.metrics.observe("furc_connect_seconds", (("phase", "login"),), time.perf_counter() - self.loginSent)
+        self.loginSent = None
+    
+    async def handlePacketMeasured(self, data):
+        #Stands in for handlePacket while instrumented, timing the real one
+        metrics = self.metrics
+        labels = (("opcode", opcodeName(data)),)
+        metrics.count("furc_packets", labels)
+        metrics.count("furc_packet_bytes", labels, len(data) + 1)
+        
+        metrics.listenerTime = 0.0
+        start = time.perf_counter()
+        await type(self).handlePacket(self, data)
+        metrics.observe("furc_decode_seconds", labels, time.perf_counter() - start - metrics.listenerTime)
     
     async def handlePacket(self, data):
-        await self.fire("Raw", data)
+        if self.fireRaw:
+            await self.fire("Raw", data)
+        opcode = data[0] - 32
+        if 0 <= opcode < OPCODE_COUNT:
+            handler = self.dispatch[opcode]
+            if handler == None:
+                return
+        else:
+            handler = self.message_unhandled
         try:
-            await getattr(
-                self,
-                "message_" + str(data[0]-32),
-                self.message_unhandled
-            )(data[0]-32, data[1:])
+            await handler(opcode, data[1:])
         except ValueError as e:
             print("DECODE FAILED ", data)
 
 #Outgoing message definitions
 class Commands:
     def login(self, character, machineid = None):
+        #Kept so a reconnecting client can log in again by itself
+        self.character = character
+        self.machineid = machineid
+        self.loginSent = time.perf_counter()
         if machineid == None:
             machineid = ""
         else:
@@ -1124,7 +1197,7 @@ class Commands:
                 character.name,
                 character.password,
                 machineid
-            ))
+            ), "control")
         
         elif character.type == character.TYPE_ACCOUNT:
             return self.command("account {} {} {}{}".format(
@@ -1132,29 +1205,32 @@ class Commands:
                 character.name,
                 character.account.password,
                 machineid
-            ))
+            ), "control")
     
     def move(self, direction):
-        return self.command("m {}".format(direction))
+        return self.command("m {}".format(direction), "move")
     
     def rotate(self, direction):
         if direction == 1:
-            return self.command(">")
+            return self.command(">", "move")
         
         elif direction == -1:
-            return self.command("<")
+            return self.command("<", "move")
     
     def vascodagama(self):
-        return self.command("vascodagama")
+        return self.command("vascodagama", "navigate")
     
     def say(self, message):
-        return self.command("\"" + message)
+        return self.command("\"" + message, "chat")
     
     def gomap(self, mapid):
-        return self.command("gomap " + base.b95encode(mapid))
+        #b95encode gives nothing for 0 without a size, but map 0 is " "
+        self.lastDream = b"gomap " + (base.b95encode(mapid) if mapid else b" ")
+        return self.command(self.lastDream, "navigate")
     
     def fdl(self, url):
-        return self.command("fdl "+url)
+        self.lastDream = ("fdl "+url).encode()
+        return self.command(self.lastDream, "navigate")
     
     def goToDream(self, furrename, dreamname = None):
         #TODO: URL Escape the names, could probably just shortname them
@@ -1164,22 +1240,95 @@ class Commands:
         return self.fdl(url)
 
 class Client(PacketHooks, Commands):
-    def __init__(self, server = None):
+    def __init__(self, server = None, chunked = False, chunkSize = 65536,
+                 coalesce = True, highWater = 65536, scheduler = None,
+                 reconnect = False, reconnectDelay = 1.0, reconnectMaxDelay = 60.0,
+                 reconnectAttempts = None):
         super().__init__()
         self.reader = None
         self.writer = None
         self.server = server or LIVE_SERVER
+        #Chunked mode reads up to chunkSize bytes at a time and splits every
+        #complete line out of it at once, instead of one readline() per line
+        self.chunked = chunked
+        self.chunkSize = chunkSize
+        
+        #With coalesce on, everything sent in the same event loop tick goes
+        #out in one write, and send() only drains past highWater bytes
+        self.coalesce = coalesce
+        self.highWater = highWater
+        self.outgoing = []
+        self.outgoingBytes = 0
+        self.writeScheduled = False
+        self.writes = 0
+        self.drains = 0
+        self.commandsSent = 0
+        
+        #Optional CommandScheduler that paces command() to the server's
+        #flood limits, send() always goes straight out
+        self.scheduler = scheduler
+        if scheduler != None:
+            scheduler.attach(self)
+        
+        #With reconnect on, run() doesn't return when the connection drops
+        #unless disconnect() was called. It reconnects with exponential
+        #backoff and jitter, logs in again as the last character and goes
+        #back to the last dream, firing Reconnecting before each attempt and
+        #Resumed once logged in again.
+        self.reconnect = reconnect
+        self.reconnectDelay = reconnectDelay
+        self.reconnectMaxDelay = reconnectMaxDelay
+        self.reconnectAttempts = reconnectAttempts
+        self.reconnects = 0
+        self.stopped = False
+        self.resuming = False
+        self.character = None
+        self.machineid = None
+        self.lastDream = None
+        if reconnect:
+            self.hook("Login", self.resumeLogin)
+            self.hook("Bookmark", self.resumeBookmark)
     
     #Basic networking stuff
     async def connect(self, server = None, loop = None, timeout = 5):
+        motd = await self.openConnection(server, timeout)
+        self.stopped = False
+        return motd
+    
+    async def openConnection(self, server = None, timeout = 5):
+        #connect() without clearing stopped, for reconnecting
         if self.connected:
-            await self.disconnect()
+            await self.dropConnection()
         
         if not server:
             server = self.server
         
-        self.reader, self.writer = await asyncio.open_connection(
-            server[0], server[1])
+        metrics = self.metrics
+        if metrics != None:
+            #Resolve separately so DNS and TCP connect are timed apart
+            start = time.perf_counter()
+            addresses = await asyncio.get_running_loop().getaddrinfo(
+                server[0], server[1], type = socket.SOCK_STREAM)
+            resolved = time.perf_counter()
+            metrics.observe("furc_connect_seconds", (("phase", "dns"),), resolved - start)
+            #Every address in turn, like open_connection does with a name
+            error = OSError("No addresses for {}".format(server[0]))
+            for family, kind, proto, name, address in addresses:
+                try:
+                    self.reader, self.writer = await asyncio.open_connection(
+                        address[0], address[1], family = family)
+                    break
+                except OSError as e:
+                    error = e
+            else:
+                raise error
+            start = time.perf_counter()
+            metrics.observe("furc_connect_seconds", (("phase", "tcp"),), start - resolved)
+        else:
+            self.reader, self.writer = await asyncio.open_connection(
+                server[0], server[1])
+        self.outgoing = []
+        self.outgoingBytes = 0
         
         motd = ""
         while self.connected:
@@ -1196,6 +1345,8 @@ class Client(PacketHooks, Commands):
                 break
             
             if data == b"Dragonroar\n":
+                if metrics != None:
+                    metrics.observe("furc_connect_seconds", (("phase", "motd"),), time.perf_counter() - start)
                 return motd
             else:
                 motd += data.decode()
@@ -1203,21 +1354,99 @@ class Client(PacketHooks, Commands):
         return None
     
     async def disconnect(self):
-        self.writer.close()
-        await self.writer.wait_closed()
+        self.stopped = True #On purpose, so don't reconnect
+        await self.dropConnection()
+    
+    async def dropConnection(self):
+        #Close the socket, leaving stopped alone so reconnecting carries on
+        if self.scheduler != None:
+            self.scheduler.cancel()
+        if self.writer == None:
+            return
+        self.writeOutgoing() #Closing the transport still sends what it holds
+        writer = self.writer
         self.reader = None
         self.writer = None
+        writer.close()
+        try:
+            await writer.wait_closed()
+        except OSError:
+            pass #Already broken, it's closed either way
     
-    async def send(self, data):
+    async def close(self):
+        #Like disconnect, but waits for queued commands to be sent first
         if self.connected:
+            await self.flush()
+            await self.disconnect()
+    
+    async def send(self, data):
+        if not self.connected:
+            return False
+        
+        self.commandsSent += 1
+        if not self.coalesce:
             self.writer.write(data)
+            self.writes += 1
             await self.writer.drain()
+            self.drains += 1
             return True
-        return False
+        
+        self.outgoing.append(data)
+        self.outgoingBytes += len(data)
+        if not self.writeScheduled:
+            self.writeScheduled = True
+            asyncio.get_running_loop().call_soon(self.writeOutgoing)
+        
+        if self.bytesPending > self.highWater:
+            await self.flush()
+        return True
+    
+    def writeOutgoing(self):
+        self.writeScheduled = False
+        if not self.outgoing:
+            return
+        
+        data = b"".join(self.outgoing)
+        self.outgoing = []
+        self.outgoingBytes = 0
+        if self.writer != None:
+            self.writer.write(data)
+            self.writes += 1
+    
+    async def flush(self):
+        #Write anything queued and wait for the socket to take it
+        self.writeOutgoing()
+        if self.writer != None:
+            await self.writer.drain()
+            self.drains += 1
+    
+    @property
+    def queueDepth(self):
+        return len(self.outgoing)
+    
+    @property
+    def bytesPending(self):
+        #Queued here plus whatever the transport hasn't handed to the socket
+        pending = self.outgoingBytes
+        if self.writer != None:
+            pending += self.writer.transport.get_write_buffer_size()
+        return pending
+    
+    def sendStats(self):
+        return {
+            "queueDepth": self.queueDepth,
+            "bytesPending": self.bytesPending,
+            "commands": self.commandsSent,
+            "writes": self.writes,
+            "drains": self.drains
+        }
     
-    def command(self, data):
+    def command(self, data, kind = None):
+        #kind is the scheduler command class, worked out from data if None
         if type(data) == str:
             data = data.encode()
+        if self.scheduler != None:
+            return self.scheduler.submit(data + b"\n", kind)
         return self.send(data + b"\n")
     
     #async def handlePacket(self, data):
@@ -1229,10 +1458,35 @@ class Client(PacketHooks, Commands):
             return False
         return True
     
+    async def handlePackets(self, lines):
+        for data in lines:
+            if len(data) == 0: #If empty, ignore
+                continue
+            
+            await self.handlePacket(data)
+            
+            if not self.connected: #A handler disconnected us
+                break
+    
     #Actual read loop, it is designed to be it's own task
     async def run(self):
+        while True:
+            if self.chunked:
+                await self.runChunked()
+            else:
+                await self.runLines()
+            
+            if not self.reconnect or self.stopped:
+                break
+            if not await self.resume():
+                break
+    
+    async def runLines(self):
         while self.connected:
-            data = await self.reader.readline()
+            try:
+                data = await self.reader.readline()
+            except OSError: #Reset by the server, same as a disconnect
+                break
             
             if not data: #None = Disconnected
                 break
@@ -1248,5 +1502,141 @@ class Client(PacketHooks, Commands):
             await self.handlePacket(data)
         
         #We are out of the loop! Presume Disconnected!
+        self.connectionLost()
+    
+    async def runChunked(self):
+        partial = b""
+        while self.connected:
+            try:
+                data = await self.reader.read(self.chunkSize)
+            except OSError: #Reset by the server, same as a disconnect
+                break
+            
+            if not data: #Disconnected, a partial line left over is incomplete
+                break
+            
+            if partial:
+                data = partial + data
+            
+            lines = data.split(b"\n")
+            partial = lines.pop() #Whatever follows the last EOL
+            
+            await self.handlePackets(lines)
+        
+        #We are out of the loop! Presume Disconnected!
+        self.connectionLost()
+    
+    def connectionLost(self):
+        #The read loop ended, close whatever is left of the transport so
+        #reconnecting starts from a clean slate
+        if self.scheduler != None:
+            self.scheduler.cancel()
+        if self.writer != None:
+            self.writer.close()
         self.reader = None
         self.writer = None
+    
+    #Reconnecting
+    async def resume(self):
+        #Reconnect after a dropped connection, True once connected again
+        attempt = 0
+        while not self.stopped:
+            if self.reconnectAttempts != None and attempt >= self.reconnectAttempts:
+                return False
+            #Full jitter, so a pool of bots doesn't come back all at once
+            delay = random.uniform(0, min(self.reconnectMaxDelay, self.reconnectDelay * 2 ** attempt))
+            attempt += 1
+            await self.fire("Reconnecting", attempt, delay)
+            await asyncio.sleep(delay)
+            
+            try:
+                motd = await self.openConnection()
+            except (OSError, asyncio.TimeoutError) as e:
+                logging.warning("Reconnect attempt {} failed: {}".format(attempt, e))
+                motd = None
+            if self.stopped:
+                #disconnect() was called while we were connecting
+                if self.connected:
+                    await self.dropConnection()
+                return False
+            if motd == None:
+                #No handshake, don't leave the half open socket behind
+                if self.connected:
+                    await self.dropConnection()
+                continue
+            
+            self.reconnects += 1
+            self.resuming = self.character != None
+            if self.resuming:
+                await self.login(self.character, self.machineid)
+            else:
+                await self.fire("Resumed", None)
+            return True
+        return False
+    
+    async def resumeLogin(self, success):
+        if not self.resuming:
+            return
+        self.resuming = False
+        if success and self.lastDream != None:
+            #Only queued, an inline listener mustn't wait for the scheduler
+            sent = self.command(self.lastDream, "navigate")
+            if self.scheduler == None:
+                await sent
+        await self.fire("Resumed", success)
+    
+    async def resumeBookmark(self, temporary, fdl):
+        #The server tells us where we are whenever we enter a dream
+        self.lastDream = b"fdl " + bytes(fdl)
+
+async def _reconnectTest(chunked, reset):
+    #A server that drops the first connection, by FIN or by RST, and keeps
+    #the second one open. The client should resume on its own.
+    connections = []
+    async def accept(reader, writer):
+        connections.append(writer)
+        writer.write(b"Dragonroar\n")
+        await writer.drain()
+        if len(connections) == 1:
+            if reset:
+                #Linger 0 makes close() send a RST instead of a FIN
+                writer.get_extra_info("socket").setsockopt(
+                    socket.SOL_SOCKET, socket.SO_LINGER, struct.pack("ii", 1, 0))
+            writer.close()
+    
+    server = await asyncio.start_server(accept, "127.0.0.1", 0)
+    client = Client(server.sockets[0].getsockname()[:2], chunked = chunked,
+                    reconnect = True, reconnectDelay = 0.01, reconnectMaxDelay = 0.01)
+    resumed = asyncio.Event()
+    async def onResumed(success):
+        resumed.set()
+    client.hook("Resumed", onResumed)
+    
+    assert await client.connect() != None, "Mock handshake failed!"
+    task = asyncio.ensure_future(client.run())
+    try:
+        await asyncio.wait_for(resumed.wait(), 5)
+    except asyncio.TimeoutError:
+        assert False, "Client didn't reconnect after a {} (chunked: {})!".format("RST" if reset else "FIN", chunked)
+    assert not task.done(), "run() returned instead of reconnecting!"
+    assert client.reconnects == 1 and len(connections) == 2, "Expected exactly one reconnect!"
+    
+    await client.disconnect()
+    await asyncio.wait_for(task, 5)
+    for writer in connections:
+        writer.close()
+    server.close()
+    await server.wait_closed()
+
+def unitTests():
+    client = Client()
+    for mapid, command in ((0, b"gomap  "), (1, b"gomap !"), (95, b"gomap ! ")):
+        client.gomap(mapid).close() #Not connected, only the command matters
+        assert client.lastDream == command, "gomap({}) sent {}!".format(mapid, client.lastDream)
+    
+    for chunked in (False, True):
+        for reset in (False, True):
+            asyncio.run(_reconnectTest(chunked, reset))
+
+if __name__ == "__main__":
+    unitTests()
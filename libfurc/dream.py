@@ -1,33 +1,173 @@
 #!/usr/bin/env python3
+import builtins
 import struct
 import io
+import mmap as mmapModule
+import os
+import sys
+from array import array
+from collections import Counter
+from numbers import Integral
 try:
     import libfurc.crypto.generic
     print(dir(libfurc.crypto.generic))
     haveCrypto = True
 except ModuleNotFoundError:
     haveCrypto = False
+try:
+    import numpy
+    haveNumpy = True
+except ModuleNotFoundError:
+    haveNumpy = False
+
+def _typecode(layer):
+    #Arrays and mapped memoryviews keep it under different names
+    return getattr(layer, "typecode", None) or layer.format
+
+def _isAxis(key):
+    return isinstance(key, (Integral, slice))
+
+def _span(base, indexes):
+    #Slice of a layer covering base + indexes, indexes being a range
+    if len(indexes) == 0:
+        return slice(0, 0)
+    step = indexes.step
+    stop = base + indexes[-1] + (1 if step > 0 else -1)
+    return slice(base + indexes[0], stop if stop >= 0 else None, step)
+
+def _axis(key, size):
+    #An int key of one axis, negative ones counting from the end
+    if key < 0:
+        key += size
+    if not 0 <= key < size:
+        raise IndexError("Tile coordinate out of range")
+    return key
+
+def _assign(layer, span, count, value):
+    #One slice assignment, from a single ID or a sequence of count IDs
+    if isinstance(value, Integral):
+        block = array(_typecode(layer), [value]) * count
+    else:
+        block = array(_typecode(layer), value)
+        if len(block) != count:
+            raise ValueError("Expected {} tiles, got {}".format(count, len(block)))
+    _store(layer, span, block)
+
+def _store(layer, span, block):
+    #Arrays resize on a slice assignment of another length, never allow it
+    if len(range(*span.indices(len(layer)))) != len(block):
+        raise ValueError("Block doesn't fit the slice")
+    layer[span] = block
 
 class TileAccessor:
+    """
+        Reads and writes one layer of a dream. Keys can be:
+            an index or a slice over the raw layer
+            (x, y), each an int or a slice, for a tile, a column, a row or a
+                rectangle: dream.floors[10:40, 20:60] = 5
+            an iterable of (x, y) coordinates, or an (n, 2) array of them
+            a (width, height) bool array, such as Dream.mask() returns with
+                NumPy
+        Rectangles read as a list of columns, dream.floors[x0:x1, y0:y1][x][y],
+        and are written from a single ID or the same shape of IDs. Each
+        column is one slice assignment.
+    """
     def __init__(self, dream, target, walls = False):
         self.dream = dream
         self.target = target
     
-    def __getitem__(self, key):
-        if type(key) == int:
-            return getattr(self.dream, self.target)[key]
-        elif type(key) == tuple and len(key) == 2:
-            return getattr(self.dream, self.target)[self.dream.coordinateToIndex(key[0], key[1])]
+    def columns(self, layer, x, y):
+        #The x coordinates and, for each of them, the slice of layer and the
+        #number of tiles the y key covers
+        height = self.dream.height
+        columns = len(layer) // height
+        if isinstance(x, Integral):
+            xs = [_axis(x, columns)]
+        else:
+            xs = range(*x.indices(columns))
+        if isinstance(y, Integral):
+            y = _axis(y, height)
+            ys = range(y, y + 1)
         else:
+            ys = range(*y.indices(height))
+        return [(_span(height * i, ys), len(ys)) for i in xs]
+    
+    def index(self, layer, x, y):
+        #Same bounds and negative coordinates as the slice keys
+        height = self.dream.height
+        return height * _axis(x, len(layer) // height) + _axis(y, height)
+    
+    def indexes(self, layer, key):
+        height = self.dream.height
+        columns = len(layer) // height
+        return [height * _axis(x, columns) + _axis(y, height) for x, y in key]
+    
+    def __getitem__(self, key):
+        layer = getattr(self.dream, self.target)
+        if isinstance(key, Integral):
+            return layer[key]
+        elif type(key) == slice:
+            return layer[key].tolist()
+        elif type(key) == tuple and len(key) == 2 and _isAxis(key[0]) and _isAxis(key[1]):
+            x, y = key
+            if isinstance(x, Integral) and isinstance(y, Integral):
+                return layer[self.index(layer, x, y)]
+            columns = [layer[span].tolist() for span, count in self.columns(layer, x, y)]
+            if isinstance(x, Integral):
+                return columns[0]
+            elif isinstance(y, Integral):
+                return [column[0] for column in columns]
+            return columns
+        elif haveNumpy and isinstance(key, numpy.ndarray):
+            grid = numpy.frombuffer(layer, _typecode(layer)).reshape(-1, self.dream.height)
+            if key.dtype == bool:
+                return grid[key]
+            return grid[key[:, 0], key[:, 1]]
+        elif isinstance(key, (str, bytes)) or not hasattr(key, "__iter__"):
             raise ValueError("Unsupported accessor")
+        else:
+            return [layer[i] for i in self.indexes(layer, key)]
 
     def __setitem__(self, key, value):
-        if type(key) == int:
-            getattr(self.dream, self.target)[key] = value
-        elif type(key) == tuple and len(key) == 2:
-            getattr(self.dream, self.target)[self.dream.coordinateToIndex(key[0], key[1])] = value
-        else:
+        layer = getattr(self.dream, self.target)
+        if isinstance(key, Integral):
+            layer[key] = value
+        elif type(key) == slice:
+            _assign(layer, key, len(range(*key.indices(len(layer)))), value)
+        elif type(key) == tuple and len(key) == 2 and _isAxis(key[0]) and _isAxis(key[1]):
+            x, y = key
+            if isinstance(x, Integral) and isinstance(y, Integral):
+                layer[self.index(layer, x, y)] = value
+                return
+            columns = self.columns(layer, x, y)
+            if isinstance(value, Integral):
+                block = array(_typecode(layer), [value]) * (columns[0][1] if columns else 0)
+                for span, count in columns:
+                    _store(layer, span, block)
+                return
+            if isinstance(x, Integral):
+                value = [value]
+            elif isinstance(y, Integral):
+                value = [[tile] for tile in value]
+            value = list(value)
+            if len(value) != len(columns):
+                raise ValueError("Expected {} columns, got {}".format(len(columns), len(value)))
+            for (span, count), column in zip(columns, value):
+                _assign(layer, span, count, column)
+        elif haveNumpy and isinstance(key, numpy.ndarray):
+            grid = numpy.frombuffer(layer, _typecode(layer)).reshape(-1, self.dream.height)
+            if key.dtype == bool:
+                grid[key] = value
+            else:
+                grid[key[:, 0], key[:, 1]] = value
+        elif isinstance(key, (str, bytes)) or not hasattr(key, "__iter__"):
             raise ValueError("Unsupported accessor")
+        elif isinstance(value, Integral):
+            for i in self.indexes(layer, key):
+                layer[i] = value
+        else:
+            for i, tile in zip(self.indexes(layer, key), value):
+                layer[i] = tile
 
 class NullAccessor:
     def __init__(self, dream, target, walls = False):
@@ -45,35 +185,80 @@ class NullAccessor:
 sUInt16 = struct.Struct("<H")
 sUInt8 = struct.Struct("<B")
 
+#Layers are stored little endian, as typed arrays in memory
+LITTLE_ENDIAN = sys.byteorder == "little"
+
+#Attribute, typecode, values per cell and the version after which the
+#layer exists, in file order
+LAYERS = (
+    ("_floors", "H", 1, None),
+    ("_items", "H", 1, None),
+    ("_walls", "B", 2, None),
+    ("_regions", "H", 1, 1.30),
+    ("_effects", "H", 1, 1.30),
+    ("_lighting", "H", 1, 1.50),
+    ("_ambient", "H", 1, 1.50)
+)
+
+def _emptyLayer(typecode, count):
+    return array(typecode, [0]) * count
+
+def _readLayer(handle, typecode, count):
+    #The whole layer in one read, swapped only on big endian hosts
+    layer = array(typecode)
+    data = handle.read(count * layer.itemsize)
+    if len(data) != count * layer.itemsize:
+        raise ValueError("Map file is truncated!")
+    layer.frombytes(data)
+    if layer.itemsize > 1 and not LITTLE_ENDIAN:
+        layer.byteswap()
+    return layer
+
+def _bool(value):
+    #Map files write flags as 1 or 0
+    if type(value) == str:
+        return value.strip() not in ("", "0")
+    return bool(value)
+
+def _formatProperty(value):
+    if type(value) == bool:
+        return "1" if value else "0"
+    return str(value)
+
 DreamTypeCast = {
     'width': int,
     'height': int,
     'revision': int,
-    'encoded': bool,
-    'patcht': bool,
+    'encoded': _bool,
+    'patcht': _bool,
     'sfxlayermode': str,
     'sfxopacity': int,
     'name': str,
     'patchs': str,
-    'noload': bool,
-    'allowjs': bool,
-    'allowlf': bool,
-    'allowfurl': bool,
-    'allowshouts': bool,
-    'allowlarge': bool,
-    'swearfilter': bool,
-    'nowho': bool,
-    'forcesittable': bool,
-    'notab': bool,
-    'nonovelty': bool,
+    'noload': _bool,
+    'allowjs': _bool,
+    'allowlf': _bool,
+    'allowfurl': _bool,
+    'allowshouts': _bool,
+    'allowlarge': _bool,
+    'swearfilter': _bool,
+    'nowho': _bool,
+    'forcesittable': _bool,
+    'notab': _bool,
+    'nonovelty': _bool,
     'rating': str,
-    'allow32bitart': bool,
-    'ismodern': bool,
-    'parentalcontrols': bool
+    'allow32bitart': _bool,
+    'ismodern': _bool,
+    'parentalcontrols': _bool
 }
 
 class Dream:
     def __init__(self, version = 1.5, **parameters):
+        self.setup(version, parameters)
+        self.allocate()
+    
+    def setup(self, version, parameters):
+        #Everything but the layers themselves
         self.properties = {}
         for parameter in parameters:
             if parameter.lower() not in DreamTypeCast:
@@ -85,10 +270,9 @@ class Dream:
             self.width = 52
             self.height = 100
         
-        cells = self.width * self.height
-        self._floors = [0] * cells
-        self._items = [0] * cells
-        self._walls = [0] * cells * 2
+        self.version = version
+        self.mapped = None
+        self.mappedBody = None
         
         self.floors = TileAccessor(self, "_floors")
         self.items = TileAccessor(self, "_items")
@@ -98,8 +282,6 @@ class Dream:
         self._effects = None
         
         if version > 1.30:
-            self._regions = [0] * cells
-            self._effects = [0] * cells
             self.regions = TileAccessor(self, "_regions")
             self.effects = TileAccessor(self, "_effects")
         
@@ -107,20 +289,35 @@ class Dream:
         self._ambient = None
         
         if version > 1.50:
-            self._lighting = [0] * cells
-            self._ambient = [0] * cells
-            self._lighting = TileAccessor(self, "_lighting")
-            self._ambient = TileAccessor(self, "_ambient")
+            self.lighting = TileAccessor(self, "_lighting")
+            self.ambient = TileAccessor(self, "_ambient")
+    
+    def layout(self):
+        #(attribute, typecode, cells) of each layer this version has, in
+        #the order they are stored in the file
+        cells = self.width * self.height
+        return [
+            (name, typecode, cells * perCell)
+            for name, typecode, perCell, since in LAYERS
+            if since == None or self.version > since
+        ]
+    
+    def allocate(self):
+        for name, typecode, count in self.layout():
+            setattr(self, name, _emptyLayer(typecode, count))
     
     def coordinateToIndex(self, x, y):
         return (self.height * x) + y
     
     def __getitem__(self, key):
-        self.properties[key]
+        return self.properties[key.lower()]
 
     def __setitem__(self, key, value):
-        if parameter.lower() not in DreamTypeCast:
-            print("[WARN] Unknown dream parameter {}".format(parameter))
+        key = key.lower()
+        if key not in DreamTypeCast:
+            print("[WARN] Unknown dream parameter {}".format(key))
+        else:
+            value = DreamTypeCast[key](value)
         self.properties[key] = value
     
     @property
@@ -139,14 +336,10 @@ class Dream:
     def height(self, value):
         self.properties["height"] = value
     
-    @classmethod
-    def fromStream(cls, handle):
-        header = b""
-        while True:
-            b = handle.read(1)
-            if b == b"\n":
-                break
-            header += b
+    @staticmethod
+    def readHeader(handle):
+        #Returns the version and the properties, leaving handle at the BODY
+        header = handle.readline().rstrip(b"\n")
         
         if header[0:5] != b"MAP V":
             raise ValueError("Not a map file!")
@@ -157,73 +350,216 @@ class Dream:
         version = float(header[5:-9])
         parameters = {}
         while True:
-            param = b""
-            while True:
-                b = handle.read(1)
-                if b == b"\n":
-                    break
-                param += b
+            param = handle.readline()
+            if not param:
+                raise ValueError("Map file has no BODY!")
+            param = param.rstrip(b"\n")
             
             if param == B"BODY":
                 break
             
             key, value = param.decode().split("=", 1)
             parameters[key] = value
+        return version, parameters
+    
+    @classmethod
+    def fromStream(cls, handle):
+        version, parameters = cls.readHeader(handle)
         
         encrypted = haveCrypto and parameters.get("encoded", "0") == "1"
         oldCrypto = version <= 1.10
         if encrypted:
             handle = io.BytesIO(libfurc.crypto.generic.decrypt(handle.read(), oldCrypto))
         
-        width, height = int(parameters["width"]), int(parameters["height"])
-        
-        dream = cls(**parameters, version = version)
+        dream = cls.__new__(cls)
+        dream.setup(version, parameters)
+        width, height = dream.width, dream.height
         
-        if encrypted:
-            dream._floors = libfurc.crypto.generic.readEncryptedDream16(handle, width, height, oldCrypto)
-        else:
-            for i in range(0, width*height):
-                dream._floors[i], = sUInt16.unpack(handle.read(2))
-        
-        if encrypted:
-            dream._items = libfurc.crypto.generic.readEncryptedDream16(handle, width, height, oldCrypto)
-        else:
-            for i in range(0, width*height):
-                dream._items[i], = sUInt16.unpack(handle.read(2))
-        
-        if encrypted:
-            dream._walls = libfurc.crypto.generic.readEncryptedDream8(handle, width, height, oldCrypto)
-        else:
-            for i in range(0, width*height*2):
-                dream._walls[i], = sUInt8.unpack(handle.read(1))
-        
-        if version > 1.30:
-            if encrypted:
-                dream._regions = libfurc.crypto.generic.readEncryptedDream16(handle, width, height, oldCrypto)
+        for name, typecode, count in dream.layout():
+            if encrypted and typecode == "B":
+                layer = libfurc.crypto.generic.readEncryptedDream8(handle, width, height, oldCrypto)
+            elif encrypted:
+                layer = libfurc.crypto.generic.readEncryptedDream16(handle, width, height, oldCrypto)
             else:
-                for i in range(0, width*height):
-                    dream._regions[i], = sUInt16.unpack(handle.read(2))
-            
-            if encrypted:
-                dream._effects = libfurc.crypto.generic.readEncryptedDream16(handle, width, height, oldCrypto)
-            else:
-                for i in range(0, width*height):
-                    dream._effects[i], = sUInt16.unpack(handle.read(2))
+                layer = _readLayer(handle, typecode, count)
+            setattr(dream, name, layer)
         
-        if version > 1.50:
-            if encrypted:
-                dream._lighting = libfurc.crypto.generic.readEncryptedDream16(handle, width, height, oldCrypto)
-            else:
-                for i in range(0, width*height):
-                    dream._lighting[i], = sUInt16.unpack(handle.read(2))
+        return dream
+    
+    @classmethod
+    def open(cls, path, mmap = True):
+        """
+            Open a map file. With mmap, layers are memoryviews over a private
+            mapping of the file instead of copies: nothing is read until it's
+            used, and the OS copies a page only when it's first written to,
+            so edits never reach the file. Encrypted maps, and big endian
+            hosts where the layers would need swapping, are read normally.
+        """
+        with builtins.open(path, "rb") as f:
+            version, parameters = cls.readHeader(f)
+            body = f.tell()
+            encrypted = parameters.get("encoded", "0") == "1"
+            if not mmap or encrypted or not LITTLE_ENDIAN:
+                f.seek(0)
+                return cls.fromStream(f)
             
-            if encrypted:
-                dream._ambient = libfurc.crypto.generic.readEncryptedDream16(handle, width, height, oldCrypto)
-            else:
-                for i in range(0, width*height):
-                    dream._ambient[i], = sUInt16.unpack(handle.read(2))
+            dream = cls.__new__(cls)
+            dream.setup(version, parameters)
+            layout = dream.layout()
+            size = body + sum(count * array(typecode).itemsize for name, typecode, count in layout)
+            if os.fstat(f.fileno()).st_size < size:
+                raise ValueError("Map file is truncated!")
+            mapped = mmapModule.mmap(f.fileno(), size, access = mmapModule.ACCESS_COPY)
         
+        dream.mapped = mapped
+        dream.mappedBody = body
+        dream.mapLayers()
         return dream
+    
+    def layer(self, name):
+        #Raw storage of a layer by its accessor name, "floors", "walls"...
+        layer = getattr(self, "_" + name, None)
+        if layer == None:
+            raise ValueError("Dream version {} has no {} layer".format(self.version, name))
+        return layer
+    
+    def grid(self, name):
+        """
+            A layer as a (width, height) ndarray sharing memory with the
+            dream, grid[x, y] being the same tile as dream.floors[x, y].
+            Walls are (width * 2, height). Writes go through to the dream.
+            On a mapped dream the array pins the mapping, drop it before
+            close() or materialize(). Needs NumPy.
+        """
+        if not haveNumpy:
+            raise ValueError("Dream.grid needs NumPy")
+        layer = self.layer(name)
+        dtype = numpy.uint8 if name == "walls" else numpy.uint16
+        return numpy.frombuffer(layer, dtype).reshape(-1, self.height)
+    
+    def histogram(self, name):
+        #{id: tiles} for every ID used in a layer
+        layer = self.layer(name)
+        if haveNumpy:
+            counts = numpy.bincount(self.grid(name).ravel())
+            ids = numpy.flatnonzero(counts)
+            return dict(zip(ids.tolist(), counts[ids].tolist()))
+        return dict(Counter(layer))
+    
+    def count(self, name, ids):
+        #Number of tiles in a layer with one of ids
+        if type(ids) == int:
+            ids = (ids,)
+        if haveNumpy:
+            return int(numpy.count_nonzero(self.mask(name, ids)))
+        ids = set(ids)
+        return sum(1 for tile in self.layer(name) if tile in ids)
+    
+    def mask(self, name, ids):
+        """
+            (width, height) bool array of the tiles in a layer with one of
+            ids. Without NumPy it's a list of columns of bools, mask[x][y],
+            which isn't a TileAccessor key; use findAll() to address the
+            tiles instead.
+        """
+        if type(ids) == int:
+            ids = (ids,)
+        if haveNumpy:
+            return numpy.isin(self.grid(name), numpy.asarray(list(ids)))
+        ids = set(ids)
+        layer = self.layer(name)
+        height = self.height
+        return [
+            [tile in ids for tile in layer[i:i + height]]
+            for i in range(0, len(layer), height)
+        ]
+    
+    def findAll(self, name, ids):
+        """
+            Coordinates of every tile in a layer with one of ids, an (n, 2)
+            array of x, y with NumPy and a list of (x, y) tuples otherwise.
+        """
+        if type(ids) == int:
+            ids = (ids,)
+        if haveNumpy:
+            return numpy.argwhere(self.mask(name, ids))
+        ids = set(ids)
+        height = self.height
+        return [divmod(i, height) for i, tile in enumerate(self.layer(name)) if tile in ids]
+    
+    def toStream(self, handle):
+        """
+            Write the map to handle, unencrypted. Each layer goes out in one
+            write straight from its buffer.
+        """
+        written = handle.write("MAP V{:05.2f} Furcadia\n".format(self.version).encode())
+        for key, value in self.properties.items():
+            if key == "encoded":
+                value = False
+            written += handle.write("{}={}\n".format(key, _formatProperty(value)).encode())
+        written += handle.write(b"BODY\n")
+        
+        for name, typecode, count in self.layout():
+            layer = getattr(self, name)
+            if len(layer) != count:
+                raise ValueError("Layer {} has {} tiles, expected {}".format(name, len(layer), count))
+            if typecode != "B" and not LITTLE_ENDIAN:
+                layer = array(typecode, layer)
+                layer.byteswap()
+            written += handle.write(layer)
+        return written
+    
+    def __bytes__(self):
+        out = io.BytesIO()
+        self.toStream(out)
+        return out.getvalue()
+    
+    def mapLayers(self):
+        #Point every layer at its part of the mapping
+        view = memoryview(self.mapped)
+        offset = self.mappedBody
+        for name, typecode, count in self.layout():
+            length = count * array(typecode).itemsize
+            setattr(self, name, view[offset:offset + length].cast(typecode))
+            offset += length
+    
+    def unmap(self):
+        #Release the layers and the mapping, or fail leaving both as they were
+        try:
+            for name, typecode, count in self.layout():
+                layer = getattr(self, name)
+                if isinstance(layer, memoryview):
+                    layer.release()
+            self.mapped.close()
+        except BufferError:
+            self.mapLayers()
+            raise BufferError("Mapped layers are still in use, drop slices and grid() arrays of them first")
+        self.mapped = None
+    
+    def materialize(self):
+        """
+            Copy mapped layers into arrays, after which the file can go.
+            Slices of the layers and grid() arrays made while mapped keep the
+            mapping alive, this raises BufferError while any exist.
+        """
+        if self.mapped == None:
+            return
+        copies = {}
+        for name, typecode, count in self.layout():
+            layer = getattr(self, name)
+            if isinstance(layer, memoryview):
+                copies[name] = array(typecode)
+                copies[name].frombytes(layer.cast("B"))
+        self.unmap()
+        for name, layer in copies.items():
+            setattr(self, name, layer)
+    
+    def close(self):
+        #Unmap the file, mapped layers can't be used afterwards. Like
+        #materialize, raises BufferError while slices or grid() arrays exist.
+        if self.mapped == None:
+            return
+        self.unmap()
 
 def load(path):
     with open(path, "rb") as f:
@@ -234,8 +570,58 @@ def loads(data):
 
 def dump(dream, path):
     with open(path, "wb") as f:
-        return f.write(bytes(dream))
+        return dream.toStream(f)
 
 def dumps(dream):
     return bytes(dream)
 
+
+def unitTests():
+    dream = Dream(version = 1.6, width = 10, height = 20)
+    
+    #Negative coordinates count from the end, for every kind of key
+    dream.floors[-1, -1] = 77
+    assert dream._floors[len(dream._floors) - 1] == 77, "Negative tile key failed!"
+    assert dream.floors[9, 19] == 77 and dream.floors[-1, 19] == 77, "Negative tile key failed!"
+    assert dream.floors[-1:, -1] == [77] and dream.floors[[(-1, -1)]] == [77], "Negative keys disagree!"
+    dream.walls[-1, 0] = 5
+    assert dream.walls[19, 0] == 5, "Negative wall key failed!"
+    
+    #Out of range raises IndexError instead of wrapping into another column
+    for key in ((0, 20), (0, -21), (10, 0), (-11, 0), (20, 0)):
+        for accessor in (dream.floors, dream.items):
+            for read in (True, False):
+                try:
+                    if read:
+                        accessor[key]
+                    else:
+                        accessor[key] = 1
+                except IndexError:
+                    pass
+                else:
+                    assert False, "Tile key {} should have failed!".format(key)
+        try:
+            dream.floors[[key]]
+        except IndexError:
+            pass
+        else:
+            assert False, "Coordinate list key {} should have failed!".format(key)
+    for key in ((0, slice(0, 1)), (slice(0, 1), 0)):
+        dream.floors[key] #Still fine
+    try:
+        dream.floors[0:1, 25]
+    except IndexError:
+        pass
+    else:
+        assert False, "Rectangle key out of range should have failed!"
+    assert dream.walls[19, 19] == 0, "Walls are twice as wide as floors!"
+    
+    #Nothing above may have resized a layer
+    for name, typecode, count in dream.layout():
+        assert len(getattr(dream, name)) == count, "Layer {} was resized!".format(name)
+    
+    #Round trip
+    assert loads(dumps(dream)).floors[9, 19] == 77, "Round trip failed!"
+
+if __name__ == "__main__":
+    unitTests()
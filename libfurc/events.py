@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+import collections
+
+def record(name, fields, aliases = None, defaults = None):
+    """
+        Build an event record type. Records are namedtuples, so they are as
+        small and as quick to build as a tuple and unpack like one, and
+        fields can be read as attributes. record["name"] and record.get()
+        still work for code written against the old dict payloads.
+    """
+    base = collections.namedtuple(name, fields, defaults = defaults)
+    aliases = aliases or {}
+    
+    def __getitem__(self, key):
+        if type(key) == str:
+            key = aliases.get(key, key)
+            if key not in self._fields:
+                raise KeyError(key)
+            return getattr(self, key)
+        return tuple.__getitem__(self, key)
+    
+    def __contains__(self, key):
+        if type(key) == str:
+            key = aliases.get(key, key)
+            return key in self._fields and getattr(self, key) != None
+        return tuple.__contains__(self, key)
+    
+    def get(self, key, default = None):
+        key = aliases.get(key, key)
+        if key not in self._fields:
+            return default
+        value = getattr(self, key)
+        return default if value == None else value
+    
+    def keys(self):
+        return self._fields
+    
+    return type(name, (base,), {
+        "__slots__": (),
+        "__getitem__": __getitem__,
+        "__contains__": __contains__,
+        "get": get,
+        "keys": keys
+    })
+
+#"from" is a keyword, so it's "source" on the records. The old key still
+#works through indexing.
+SetRegionEntry = record("SetRegionEntry", "pos id")
+DSTrigger = record("DSTrigger", "source to extra line", {"from": "source"})
+DSEventAddon = record("DSEventAddon",
+    "moveFlag randSeed saidNum facingDir entryCode objPaws furreCount userID "
+    "DSBtn dreamCookies triggererCookies portalOpen second minute hour day "
+    "month year portalClose"
+)
+CameraMove = record("CameraMove", "to source", {"from": "source"}, (None,))
+PounceEntry = record("PounceEntry", "character fuid status unk4 unk5 unk6 flags name")
+PounceStatus = record("PounceStatus", "fuid status")
+DynamicAvatar = record("DynamicAvatar", "version flags updated")
+GloamLight = record("GloamLight", "color intensity")
+RegionDefaults = record("RegionDefaults", "object wall floor effect")
+WallHeights = record("WallHeights", "bottom top")
+RegionSettings = record("RegionSettings", "outdoor indoor unk1 walls unk2 unk3 unk4 unk5 unk6")
+ArtPixel = record("ArtPixel", "pixel color unk x y")
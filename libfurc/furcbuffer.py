@@ -1,15 +1,41 @@
 #!/usr/bin/env python3 
+import re
 from . import base
 
+_searchers = {}
+
+def _searcher(seperators):
+    #memoryview has no find(), but compiled patterns search any buffer
+    pattern = _searchers.get(seperators)
+    if pattern == None:
+        #Longest first, so b"\r\n" wins over b"\r" at the same position
+        ordered = sorted(seperators, key = len, reverse = True)
+        pattern = re.compile(b"|".join(re.escape(bytes(s)) for s in ordered))
+        _searchers[seperators] = pattern
+    return pattern
+
 #TODO: Convert to bytesIO?
 class FurcBuffer:
-    def __init__(self, buffer = None):
+    def __init__(self, buffer = None, view = False):
         if buffer == None:
             buffer = b""
+        #In view mode reads hand out memoryview slices of the buffer instead
+        #of copies. Wrap a bytearray to get views that can be written through.
+        if view and not isinstance(buffer, memoryview):
+            buffer = memoryview(buffer)
+        self.view = view or isinstance(buffer, memoryview)
         self.buffer = buffer
         self.offset = 0
     
     def __bytes__(self):
+        return self.getvalue()
+    
+    def getvalue(self):
+        #Writes accumulate in a bytearray, turn it into bytes once here
+        if type(self.buffer) is bytearray:
+            self.buffer = bytes(self.buffer)
+        if self.view:
+            return bytes(self.buffer)
         return self.buffer
     
     @property
@@ -23,6 +49,8 @@ class FurcBuffer:
     
     
     def read(self, l = None):
+        if type(self.buffer) is bytearray:
+            self.buffer = bytes(self.buffer)
         if l == None:
             v = self.buffer[self.offset:]
             self.offset = len(self.buffer)
@@ -31,44 +59,122 @@ class FurcBuffer:
             self.offset += l
         return v
     
+    def readBytes(self, l = None):
+        #Like read, but always returns bytes, even in view mode
+        v = self.read(l)
+        if self.view:
+            return bytes(v)
+        return v
+    
     def write(self, data):
-        self.buffer = self.buffer[:self.offset] + data + self.buffer[self.offset + len(data):]
-        self.offset += len(data)
+        end = self.offset + len(data)
+        if self.view:
+            if end <= len(self.buffer) and not self.buffer.readonly:
+                self.buffer[self.offset:end] = data
+            else:
+                #Views can't grow, this is the slow path
+                buffer = bytes(self.buffer)
+                self.buffer = memoryview(buffer[:self.offset] + data + buffer[end:])
+        else:
+            if type(self.buffer) is not bytearray:
+                self.buffer = bytearray(self.buffer)
+            #Appends at the end are amortized O(1), and writing after seeking
+            #backwards overwrites in place, same as splicing into bytes did.
+            self.buffer[self.offset:end] = data
+        self.offset = end
     
     
     def readBuffer(self, l = 1):
-        return FurcBuffer(self.read(l))
+        return FurcBuffer(self.read(l), self.view)
     
     def writeBuffer(self, v):
-        self.write(v.buffer)
+        self.write(bytes(v))
     
     
     def readUntil(self, seperator = b" "):
-        data = b""
-        while not self.eof:
-            c = self.read(1)
-            if c == seperator:
-                return data
-            data += c
-        return data
-    
-    
+        if type(self.buffer) is bytearray:
+            self.buffer = bytes(self.buffer)
+        start = self.offset
+        if start >= len(self.buffer):
+            return self.buffer[start:start]
+        
+        if self.view:
+            match = _searcher((seperator,)).search(self.buffer, start)
+            end = match.start() if match else -1
+        else:
+            end = self.buffer.find(seperator, start)
+        
+        if end < 0:
+            self.offset = len(self.buffer)
+            return self.buffer[start:]
+        
+        self.offset = end + len(seperator)
+        return self.buffer[start:end]
+    
+    def readUntilAny(self, seperators = (b" ",)):
+        #Stops at whichever seperator comes first, they may be multi-byte
+        if type(self.buffer) is bytearray:
+            self.buffer = bytes(self.buffer)
+        start = self.offset
+        if start >= len(self.buffer):
+            return self.buffer[start:start]
+        
+        match = _searcher(tuple(seperators)).search(self.buffer, start)
+        if match == None:
+            self.offset = len(self.buffer)
+            return self.buffer[start:]
+        
+        self.offset = match.end()
+        return self.buffer[start:match.start()]
+    
+    def split(self, seperator = b" "):
+        """
+            Yield successive fields up to each seperator as memoryviews,
+            starting from the current offset, like calling readUntil until
+            eof. The offset advances as fields are consumed.
+        """
+        if type(self.buffer) is bytearray:
+            self.buffer = bytes(self.buffer)
+        view = self.buffer if self.view else memoryview(self.buffer)
+        while self.offset < len(view):
+            start = self.offset
+            if self.view:
+                match = _searcher((seperator,)).search(view, start)
+                end = match.start() if match else -1
+            else:
+                end = self.buffer.find(seperator, start)
+            
+            if end < 0:
+                self.offset = len(view)
+                yield view[start:]
+            else:
+                self.offset = end + len(seperator)
+                yield view[start:end]
+    
+    
+    
+    #Integer fields decode straight out of the buffer, no slice is made
+    def _fieldSize(self, l):
+        remaining = len(self.buffer) - self.offset
+        if remaining < l:
+            return max(remaining, 0)
+        return l
     
     def read95(self, l = 1):
+        offset = self.offset
+        size = self._fieldSize(l)
+        self.offset += l
         try:
-            return base.b95decode(self.read(l))
+            return base.b95decodeAt(self.buffer, offset, size)
         except ValueError as e:
-            raise ValueError("Failed to decode message {} at {}".format(self.buffer, self.offset - l))
+            raise ValueError("Failed to decode message {} at {}".format(bytes(self.buffer), offset))
     
     def write95(self, v, l = 1):
         self.write(base.b95encode(v, l))
     
     
     def read95Bytes(self, l = 1):
-        try:
-            return self.read(base.b95decode(self.read(l)))
-        except ValueError as e:
-            raise ValueError("Failed to decode message {} at {}".format(self.buffer, self.offset - l))
+        return self.read(self.read95(l))
     
     def write95Bytes(self, data, l = 1):
         if len(data)/95 > l:
@@ -79,7 +185,7 @@ class FurcBuffer:
     
     
     def read95String(self, l = 1):
-        return self.read95Bytes(l).decode()
+        return str(self.read95Bytes(l), "utf-8")
     
     def write95String(self, v, l = 1):
         return self.write95Bytes(v.encode(), l)
@@ -87,20 +193,20 @@ class FurcBuffer:
     
     
     def read220(self, l = 1):
+        offset = self.offset
+        size = self._fieldSize(l)
+        self.offset += l
         try:
-            return base.b220decode(self.read(l))
+            return base.b220decodeAt(self.buffer, offset, size)
         except ValueError as e:
-            raise ValueError("Failed to decode message {} at {}".format(self.buffer, self.offset - l))
+            raise ValueError("Failed to decode message {} at {}".format(bytes(self.buffer), offset))
     
     def write220(self, v, l = 1):
         self.write(base.b220encode(v, l))
     
     
     def read220Bytes(self, l = 1):
-        try:
-            return self.read(base.b220decode(self.read(l)))
-        except ValueError as e:
-            raise ValueError("Failed to decode message {} at {}".format(self.buffer, self.offset - l))
+        return self.read(self.read220(l))
     
     def write220Bytes(self, data, l = 1):
         if len(data)/220 > l:
@@ -115,7 +221,7 @@ class FurcBuffer:
         for i in range(l):
             v = self.read220(self.read(2))
             if v > 255: #No need to check for underflow, base220 is unsigned.
-                raise ValueError("Base 220 byte array in message {} at {} is out of range!".format(self.buffer, self.offset - 2))
+                raise ValueError("Base 220 byte array in message {} at {} is out of range!".format(bytes(self.buffer), self.offset - 2))
             result.append(v)
         
         return bytes(result)
@@ -130,7 +236,7 @@ class FurcBuffer:
     
     
     def read220String(self, l = 1):
-        return self.read220Bytes(l).decode()
+        return str(self.read220Bytes(l), "utf-8")
     
     def write220String(self, v, l = 1):
         return self.write220Bytes(v.encode(), l)
\ No newline at end of file
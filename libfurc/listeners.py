@@ -0,0 +1,196 @@
+#!/usr/bin/env python3
+import asyncio
+import collections
+import logging
+import time
+
+#Events that should never wait behind world state updates
+HIGH_PRIORITY_EVENTS = (
+    "Login", "Disconnect", "Authenticate", "VersionReq", "Update", "Marco",
+    "Reconnecting", "Resumed"
+)
+
+#Bulk world state, these can arrive by the thousand on map load
+LOW_PRIORITY_EVENTS = (
+    "SetFloor", "SetWall", "SetObject", "SetEffect", "SetSFX", "SetAmbient",
+    "SetRegion", "SetVariables", "RegionFlags", "DSVariableStack", "Gloam",
+    "DynamicAvatars", "KitterDust", "Particles", "ArtPartyDraw"
+)
+
+class Listener:
+    #Execution policies
+    INLINE = 0 #Awaited by fire(), in order. The default.
+    TASK = 1 #Detached into its own task
+    QUEUE = 2 #Handed to a bounded worker that runs one event at a time
+    
+    #What a QUEUE listener does when its queue is full
+    BLOCK = 0 #Wait for space, which holds up the read loop (backpressure)
+    DROP_NEWEST = 1 #Drop the incoming event
+    DROP_OLDEST = 2 #Drop the oldest event of the lowest priority queued, if
+                    #that's no higher than the incoming one's, else drop it
+    
+    #Priorities
+    PRIORITY_HIGH = 0
+    PRIORITY_NORMAL = 1
+    PRIORITY_LOW = 2
+    
+    def __init__(self, hooks, event, func, policy = INLINE, queueSize = 256,
+                 overflow = BLOCK):
+        self.hooks = hooks
+        self.event = event
+        self.func = func
+        self.policy = policy
+        self.queueSize = queueSize
+        self.overflow = overflow
+        
+        #Stats
+        self.calls = 0
+        self.totalTime = 0.0
+        self.maxTime = 0.0
+        self.slow = 0
+        self.dropped = 0
+        self.errors = 0
+        
+        self.tasks = set()
+        self.active = 0
+        self.pending = None
+        self.worker = None
+        self.wakeup = None
+        self.space = None
+    
+    def __repr__(self):
+        return "<Listener {} for {}>".format(getattr(self.func, "__qualname__", self.func), self.event)
+    
+    #Compare equal to the wrapped function, so off(name, func) finds us
+    def __eq__(self, other):
+        if isinstance(other, Listener):
+            return self is other
+        return self.func == other
+    
+    def __hash__(self):
+        return hash(self.func)
+    
+    @property
+    def depth(self):
+        if self.pending == None:
+            return len(self.tasks)
+        return sum(len(q) for q in self.pending) + len(self.tasks)
+    
+    def priorityOf(self, args):
+        #Wildcard listeners get the event name as their first argument
+        event = args[0] if self.event == "*" and args else self.event
+        return self.hooks.eventPriority.get(event, self.PRIORITY_NORMAL)
+    
+    async def __call__(self, *args, **kwargs):
+        if self.policy == self.INLINE:
+            await self.run(args, kwargs)
+        
+        elif self.policy == self.TASK:
+            if self.priorityOf(args) == self.PRIORITY_HIGH:
+                #Run ahead of anything still detached
+                await self.run(args, kwargs)
+                return
+            task = asyncio.ensure_future(self.run(args, kwargs, True))
+            self.tasks.add(task)
+            task.add_done_callback(self.tasks.discard)
+        
+        elif self.policy == self.QUEUE:
+            await self.enqueue(args, kwargs)
+        
+        else:
+            raise ValueError("Unknown listener policy {}".format(self.policy))
+    
+    async def run(self, args, kwargs, detached = False):
+        start = time.perf_counter()
+        try:
+            await self.func(*args, **kwargs)
+        except Exception:
+            self.errors += 1
+            if not detached:
+                raise
+            logging.exception("Listener {} failed".format(self))
+        finally:
+            elapsed = time.perf_counter() - start
+            self.calls += 1
+            self.totalTime += elapsed
+            if elapsed > self.maxTime:
+                self.maxTime = elapsed
+            if elapsed >= self.hooks.slowListenerTime:
+                self.slow += 1
+                logging.warning("Slow listener {} took {:.1f}ms".format(self, elapsed * 1000))
+    
+    async def enqueue(self, args, kwargs):
+        if self.pending == None:
+            self.pending = [collections.deque() for i in range(3)]
+            self.wakeup = asyncio.Event()
+            self.space = asyncio.Event()
+            self.worker = asyncio.ensure_future(self.work())
+        
+        priority = self.priorityOf(args)
+        while sum(len(q) for q in self.pending) >= self.queueSize:
+            if self.overflow == self.DROP_NEWEST:
+                self.dropped += 1
+                return
+            
+            elif self.overflow == self.DROP_OLDEST:
+                self.dropped += 1
+                #Never make room by evicting something more important
+                for q in reversed(self.pending[priority:]):
+                    if q:
+                        q.popleft()
+                        break
+                else:
+                    return
+            
+            else:
+                self.space.clear()
+                await self.space.wait()
+        
+        self.pending[priority].append((args, kwargs))
+        self.wakeup.set()
+    
+    async def work(self):
+        while True:
+            for q in self.pending:
+                if q:
+                    args, kwargs = q.popleft()
+                    break
+            else:
+                self.wakeup.clear()
+                await self.wakeup.wait()
+                continue
+            
+            self.space.set()
+            self.active += 1
+            try:
+                await self.run(args, kwargs, True)
+            finally:
+                self.active -= 1
+    
+    async def join(self):
+        #Wait until everything handed to this listener has run
+        while self.depth or self.active:
+            if self.tasks:
+                await asyncio.wait(list(self.tasks))
+            else:
+                await asyncio.sleep(0.001)
+    
+    def close(self):
+        if self.worker:
+            self.worker.cancel()
+            self.worker = None
+        self.pending = None
+    
+    def stats(self):
+        return {
+            "event": self.event,
+            "listener": getattr(self.func, "__qualname__", repr(self.func)),
+            "policy": self.policy,
+            "calls": self.calls,
+            "totalTime": self.totalTime,
+            "maxTime": self.maxTime,
+            "slow": self.slow,
+            "dropped": self.dropped,
+            "errors": self.errors,
+            "depth": self.depth
+        }
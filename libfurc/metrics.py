@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+import bisect
+import logging
+import math
+
+#Upper bounds in seconds, from 10us up, the last bucket catches the rest
+DEFAULT_BUCKETS = (
+    0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005,
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+    0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0
+)
+
+class Histogram:
+    def __init__(self, buckets = DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.min = None
+        self.max = None
+    
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        if self.min == None or value < self.min:
+            self.min = value
+        if self.max == None or value > self.max:
+            self.max = value
+    
+    def percentile(self, p):
+        #Upper bound of the bucket the pth percentile falls in
+        if self.count == 0:
+            return None
+        rank = max(1, math.ceil(self.count * p))
+        seen = 0
+        for i, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                return self.buckets[i] if i < len(self.buckets) else self.max
+        return self.max
+    
+    @property
+    def mean(self):
+        return self.sum / self.count if self.count else None
+
+class MemorySink:
+    """
+        Keeps counters and histograms in memory, keyed by metric name and a
+        tuple of (label, value) pairs.
+    """
+    def __init__(self, buckets = DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counters = {}
+        self.histograms = {}
+    
+    def count(self, name, labels, value):
+        key = (name, labels)
+        self.counters[key] = self.counters.get(key, 0) + value
+    
+    def observe(self, name, labels, seconds):
+        key = (name, labels)
+        histogram = self.histograms.get(key)
+        if histogram == None:
+            histogram = self.histograms[key] = Histogram(self.buckets)
+        histogram.observe(seconds)
+    
+    def counter(self, name, **labels):
+        return self.counters.get((name, tuple(sorted(labels.items()))), 0)
+    
+    def histogram(self, name, **labels):
+        return self.histograms.get((name, tuple(sorted(labels.items()))))
+    
+    def reset(self):
+        self.counters = {}
+        self.histograms = {}
+
+class LoggingSink:
+    """
+        Logs timings of at least minimum seconds. Counters are ignored, so
+        this suits connect phases and slow decodes rather than totals.
+    """
+    def __init__(self, minimum = 0.0, level = logging.INFO, logger = None):
+        self.minimum = minimum
+        self.level = level
+        self.logger = logger or logging.getLogger("libfurc.metrics")
+    
+    def count(self, name, labels, value):
+        pass
+    
+    def observe(self, name, labels, seconds):
+        if seconds >= self.minimum:
+            self.logger.log(self.level, "{}{} {:.3f}ms".format(
+                name, _labelText(labels), seconds * 1000
+            ))
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+def _labelText(labels, extra = ()):
+    labels = tuple(labels) + tuple(extra)
+    if not labels:
+        return ""
+    return "{" + ",".join("{}=\"{}\"".format(k, _escape(v)) for k, v in labels) + "}"
+
+def openMetrics(sink):
+    """
+        Render a MemorySink in the OpenMetrics text format. Counters get a
+        _total suffix, histograms get _bucket/_count/_sum series.
+    """
+    lines = []
+    names = sorted(set(name for name, labels in sink.counters))
+    for name in names:
+        lines.append("# TYPE {} counter".format(name))
+        for (n, labels), value in sorted(sink.counters.items()):
+            if n == name:
+                lines.append("{}_total{} {}".format(name, _labelText(labels), value))
+    
+    names = sorted(set(name for name, labels in sink.histograms))
+    for name in names:
+        lines.append("# TYPE {} histogram".format(name))
+        lines.append("# UNIT {} seconds".format(name))
+        for (n, labels), histogram in sorted(sink.histograms.items()):
+            if n != name:
+                continue
+            seen = 0
+            for bound, count in zip(histogram.buckets, histogram.counts):
+                seen += count
+                lines.append("{}_bucket{} {}".format(name, _labelText(labels, (("le", bound),)), seen))
+            lines.append("{}_bucket{} {}".format(name, _labelText(labels, (("le", "+Inf"),)), histogram.count))
+            lines.append("{}_count{} {}".format(name, _labelText(labels), histogram.count))
+            lines.append("{}_sum{} {}".format(name, _labelText(labels), histogram.sum))
+    
+    lines.append("# EOF")
+    return "\n".join(lines) + "\n"
+
+def opcodeName(data):
+    #Label for a packet, "A" or "]A" for protocol extensions
+    size = 2 if data[:1] == b"]" else 1
+    return bytes(data[:size]).decode("latin-1")
+
+class Metrics:
+    """
+        Hands measurements out to every sink. Attached to a client with
+        Client.instrument(), which records:
+            furc_connect_seconds{phase="dns"|"tcp"|"motd"|"login"}
+            furc_packets{opcode} and furc_packet_bytes{opcode}
+            furc_decode_seconds{opcode}, handler time minus listener time
+            furc_listener_seconds{event}
+    """
+    def __init__(self, *sinks):
+        self.sinks = list(sinks)
+        self.listenerTime = 0.0 #Listener time inside the current packet
+    
+    def count(self, name, labels, value = 1):
+        for sink in self.sinks:
+            sink.count(name, labels, value)
+    
+    def observe(self, name, labels, seconds):
+        for sink in self.sinks:
+            sink.observe(name, labels, seconds)
@@ -0,0 +1,203 @@
+#!/usr/bin/env python3
+import asyncio
+import time
+from .capture import CaptureReader
+
+class MockSession:
+    def __init__(self, server, reader, writer):
+        self.server = server
+        self.reader = reader
+        self.writer = writer
+        self.name = None
+        self.loggedIn = False
+        self.commands = []
+        self.packetsSent = 0
+        self.bytesSent = 0
+        self.started = time.monotonic()
+        self.streamer = None
+        self.task = None
+    
+    def send(self, line):
+        self.writer.write(line + b"\n")
+        self.packetsSent += 1
+        self.bytesSent += len(line) + 1
+    
+    async def handle(self, line):
+        self.commands.append(line)
+        self.server.commands += 1
+        command, _, args = line.partition(b" ")
+        if command == b"connect" or command == b"account":
+            args = args.split(b" ")
+            if command == b"connect":
+                name, password = args[0], args[1] if len(args) > 1 else b""
+            else:
+                name, password = (args[1], args[2]) if len(args) > 2 else (b"", b"")
+            self.name = name.decode(errors = "replace")
+            
+            if self.server.authenticate(self.name, password.decode(errors = "replace")):
+                self.loggedIn = True
+                self.server.logins += 1
+                self.send(b"&")
+                self.startStreaming()
+            else:
+                self.server.failedLogins += 1
+                self.send(b"]]Incorrect name or password")
+            await self.writer.drain()
+        
+        elif command == b"quit":
+            self.writer.close()
+    
+    def startStreaming(self):
+        if self.streamer == None and self.server.traffic != None:
+            self.streamer = asyncio.ensure_future(self.stream())
+    
+    async def stream(self):
+        server = self.server
+        try:
+            for i in range(server.repeat):
+                started = time.monotonic()
+                sent = 0
+                for timestamp, line in server.lines():
+                    if server.rate != None:
+                        due = sent / server.rate
+                    elif server.speed != None and timestamp != None:
+                        due = timestamp / server.speed
+                    else:
+                        due = None
+                    
+                    if due != None:
+                        delay = due - (time.monotonic() - started)
+                        if delay > 0:
+                            #Whatever is due by now goes out in one write
+                            await self.writer.drain()
+                            await asyncio.sleep(delay)
+                    
+                    self.send(line)
+                    sent += 1
+                    server.packetsSent += 1
+                    if self.writer.transport.get_write_buffer_size() > server.highWater:
+                        await self.writer.drain()
+                await self.writer.drain()
+            
+            if server.hangup:
+                self.writer.close()
+        except ConnectionError:
+            pass
+    
+    async def run(self):
+        server = self.server
+        for line in server.motd:
+            self.send(line)
+        self.send(b"Dragonroar")
+        await self.writer.drain()
+        if not server.requireLogin:
+            self.startStreaming()
+        
+        try:
+            while True:
+                line = await self.reader.readline()
+                if not line or line[-1] != 10:
+                    break
+                await self.handle(line[:-1])
+        except ConnectionError:
+            pass
+        finally:
+            if self.streamer != None:
+                self.streamer.cancel()
+            self.writer.close()
+
+class MockServer:
+    """
+        Local stand-in for the game server, for load testing clients without
+        touching the live game. It sends a MOTD and the Dragonroar
+        handshake, answers connect/account logins with "&" (or "]]" when
+        authenticate returns False), then streams traffic to the session.
+        
+        traffic is a list of lines, a list of (timestamp, line) pairs, or a
+        capture file path or CaptureReader. rate paces it in packets per
+        second; without a rate, timestamped traffic keeps its original
+        pacing scaled by speed, and anything else goes as fast as the
+        client reads it. Each session gets the traffic repeat times.
+    """
+    def __init__(self, traffic = None, rate = None, speed = None, repeat = 1,
+                 motd = None, requireLogin = True, hangup = False,
+                 authenticate = None, highWater = 65536):
+        if type(traffic) == str:
+            traffic = CaptureReader(traffic)
+        if isinstance(traffic, CaptureReader):
+            traffic = list(traffic)
+        self.traffic = traffic
+        self.rate = rate
+        self.speed = speed
+        self.repeat = repeat
+        self.motd = motd or [b"Welcome to the libfurc mock server"]
+        self.requireLogin = requireLogin
+        self.hangup = hangup
+        self.authenticate = authenticate or (lambda name, password: True)
+        self.highWater = highWater
+        
+        self.server = None
+        self.sessions = set()
+        
+        #Stats
+        self.connections = 0
+        self.logins = 0
+        self.failedLogins = 0
+        self.commands = 0
+        self.packetsSent = 0
+    
+    def lines(self):
+        for entry in self.traffic:
+            if type(entry) == tuple:
+                yield entry
+            else:
+                yield None, entry
+    
+    @property
+    def address(self):
+        return self.server.sockets[0].getsockname()[:2]
+    
+    async def start(self, host = "127.0.0.1", port = 0, backlog = 4096):
+        #Port 0 picks a free port, see address
+        self.server = await asyncio.start_server(self.accept, host, port, backlog = backlog)
+        return self.address
+    
+    async def accept(self, reader, writer):
+        session = MockSession(self, reader, writer)
+        session.task = asyncio.current_task()
+        self.sessions.add(session)
+        self.connections += 1
+        try:
+            await session.run()
+        except asyncio.CancelledError:
+            pass #Server closing, this task is ours to end quietly
+        finally:
+            self.sessions.discard(session)
+    
+    async def close(self):
+        if self.server != None:
+            self.server.close()
+            sessions = list(self.sessions)
+            for session in sessions:
+                session.task.cancel()
+            if sessions:
+                await asyncio.wait([session.task for session in sessions])
+            await self.server.wait_closed()
+            self.server = None
+    
+    async def __aenter__(self):
+        await self.start()
+        return self
+    
+    async def __aexit__(self, *args):
+        await self.close()
+    
+    def stats(self):
+        return {
+            "connections": self.connections,
+            "active": len(self.sessions),
+            "logins": self.logins,
+            "failedLogins": self.failedLogins,
+            "commands": self.commands,
+            "packetsSent": self.packetsSent
+        }
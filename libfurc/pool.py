@@ -0,0 +1,268 @@
+#!/usr/bin/env python3
+import asyncio
+import logging
+import time
+from .client import Client
+from .scheduler import CommandScheduler, TokenBucket
+
+class PoolSession:
+    #States
+    IDLE = "idle"
+    CONNECTING = "connecting"
+    RUNNING = "running"
+    WAITING = "waiting" #Died, waiting to be restarted
+    STOPPED = "stopped"
+    
+    def __init__(self, pool, tag, character, client, machineid = None, restart = True):
+        self.pool = pool
+        self.tag = tag
+        self.character = character
+        self.client = client
+        self.machineid = machineid
+        self.restart = restart
+        self.state = self.IDLE
+        self.task = None
+        
+        #Stats
+        self.connects = 0
+        self.failures = 0
+        self.restarts = 0
+        self.packets = 0
+        self.bytes = 0
+        self.connectTime = None
+        self.loginTime = None
+        self.loginSent = None
+        self.started = None
+        self.error = None #Last exception that killed the session
+        self.streak = 0 #Failures in a row, for the restart backoff
+        
+        client.hook("Raw", self.raw)
+        client.hook("Login", self.login)
+    
+    def __repr__(self):
+        return "<PoolSession {} {}>".format(self.tag, self.state)
+    
+    async def raw(self, data):
+        self.packets += 1
+        self.bytes += len(data) + 1
+    
+    async def login(self, success):
+        if success and self.loginSent != None:
+            self.loginTime = time.monotonic() - self.loginSent
+            self.loginSent = None
+    
+    async def connect(self):
+        self.state = self.CONNECTING
+        async with self.pool.connecting:
+            start = time.monotonic()
+            motd = await self.client.connect()
+            if motd == None:
+                return False
+            self.connectTime = time.monotonic() - start
+            self.connects += 1
+            self.loginSent = time.monotonic()
+            await self.client.login(self.character, self.machineid)
+        return True
+    
+    async def run(self):
+        while not self.pool.closing:
+            try:
+                if await self.connect():
+                    self.state = self.RUNNING
+                    self.started = time.monotonic()
+                    await self.client.run()
+                    self.streak = 0
+                else:
+                    self.failures += 1
+                    self.streak += 1
+            except (OSError, asyncio.TimeoutError) as e:
+                self.failures += 1
+                self.streak += 1
+                self.error = e
+                logging.warning("Session {} failed to connect: {}".format(self.tag, e))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                #Most likely a listener, the session is restarted all the same
+                self.failures += 1
+                self.streak += 1
+                self.error = e
+                logging.exception("Session {} died".format(self.tag))
+                if self.client.connected:
+                    await self.client.disconnect()
+            
+            if self.pool.closing or not self.restart:
+                break
+            self.state = self.WAITING
+            self.restarts += 1
+            await asyncio.sleep(min(self.pool.restartDelay * 2 ** max(self.streak - 1, 0),
+                                    self.pool.restartMaxDelay))
+        self.state = self.STOPPED
+    
+    def stats(self):
+        uptime = time.monotonic() - self.started if self.started and self.state == self.RUNNING else 0
+        result = {
+            "tag": self.tag,
+            "state": self.state,
+            "connects": self.connects,
+            "failures": self.failures,
+            "restarts": self.restarts,
+            "packets": self.packets,
+            "bytes": self.bytes,
+            "packetsPerSecond": self.packets / uptime if uptime else 0,
+            "connectTime": self.connectTime,
+            "loginTime": self.loginTime,
+            "error": repr(self.error) if self.error != None else None
+        }
+        result.update(self.client.sendStats() if self.client.connected else {})
+        if self.client.scheduler != None:
+            result["scheduler"] = self.client.scheduler.stats()
+        return result
+
+class ClientPool:
+    """
+        Runs many clients on one event loop. Sessions connect in parallel, at
+        most concurrency at a time, and are restarted restartDelay seconds
+        after they die, doubling up to restartMaxDelay while they keep
+        dying, whether from the connection or an exception in a listener.
+        Every session's commands go through its own
+        CommandScheduler (sessionRate/sessionBurst) which also has to take
+        from one bucket shared by the whole pool (rate/burst), so the pool
+        as a whole stays under the server's limits.
+        
+        Listeners added with hook() are added to every session and called
+        with the session tag first, hook("Message", func) calls
+        func(tag, message).
+    """
+    def __init__(self, server = None, concurrency = 10, rate = 20.0, burst = 20.0,
+                 sessionRate = 8.0, sessionBurst = 10.0, restart = True,
+                 restartDelay = 5.0, restartMaxDelay = 300.0, **clientOptions):
+        self.server = server
+        self.concurrency = concurrency
+        self.connecting = asyncio.Semaphore(concurrency)
+        self.bucket = TokenBucket(rate, burst) if rate != None else None
+        self.sessionRate = sessionRate
+        self.sessionBurst = sessionBurst
+        self.restart = restart
+        self.restartDelay = restartDelay
+        self.restartMaxDelay = restartMaxDelay
+        self.clientOptions = clientOptions
+        self.sessions = {}
+        self.listeners = []
+        self.running = False
+        self.closing = False
+    
+    def __len__(self):
+        return len(self.sessions)
+    
+    def __getitem__(self, tag):
+        return self.sessions[tag]
+    
+    def add(self, character, tag = None, client = None, machineid = None, restart = None):
+        """
+            Add a session for character. A client can be passed in to keep
+            its own listeners, otherwise one is made from the pool's options.
+        """
+        if tag == None:
+            tag = character.name
+        if tag in self.sessions:
+            raise ValueError("Duplicate session tag {}".format(tag))
+        
+        scheduler = CommandScheduler(
+            self.sessionRate, self.sessionBurst,
+            buckets = [self.bucket] if self.bucket != None else None
+        )
+        if client == None:
+            client = Client(self.server, scheduler = scheduler, **self.clientOptions)
+        else:
+            if self.server != None:
+                client.server = self.server
+            if client.scheduler == None:
+                client.scheduler = scheduler
+                scheduler.attach(client)
+            elif self.bucket != None and self.bucket not in client.scheduler.buckets:
+                client.scheduler.buckets.append(self.bucket)
+        
+        session = PoolSession(self, tag, character, client, machineid,
+                              self.restart if restart == None else restart)
+        self.sessions[tag] = session
+        for event, func, options in self.listeners:
+            self._hookSession(session, event, func, options)
+        
+        if self.running and not self.closing:
+            session.task = asyncio.ensure_future(session.run())
+        return session
+    
+    def _hookSession(self, session, event, func, options):
+        tag = session.tag
+        async def tagged(*args, **kwargs):
+            await func(tag, *args, **kwargs)
+        tagged.__qualname__ = getattr(func, "__qualname__", repr(func))
+        session.client.hook(event, tagged, **options)
+    
+    def hook(self, event, func, **options):
+        #options are passed to Client.hook, such as policy
+        self.listeners.append((event, func, options))
+        for session in self.sessions.values():
+            self._hookSession(session, event, func, options)
+    
+    def on(self, event, **options):
+        def _(func):
+            self.hook(event, func, **options)
+            return func
+        return _
+    
+    def start(self):
+        self.running = True
+        self.closing = False
+        for session in self.sessions.values():
+            if session.task == None or session.task.done():
+                session.task = asyncio.ensure_future(session.run())
+    
+    async def run(self):
+        #Start everything and wait until every session has stopped
+        self.start()
+        while True:
+            tasks = [s.task for s in self.sessions.values() if s.task != None and not s.task.done()]
+            if not tasks:
+                break
+            await asyncio.wait(tasks)
+    
+    async def remove(self, tag):
+        session = self.sessions.pop(tag)
+        session.restart = False
+        if session.client.connected:
+            await session.client.close()
+        if session.task != None:
+            session.task.cancel()
+        session.state = session.STOPPED
+        return session
+    
+    async def close(self):
+        self.closing = True
+        for session in self.sessions.values():
+            if session.client.connected:
+                await session.client.close()
+        for session in self.sessions.values():
+            if session.task != None:
+                session.task.cancel()
+        tasks = [s.task for s in self.sessions.values() if s.task != None]
+        if tasks:
+            await asyncio.wait(tasks)
+        for session in self.sessions.values():
+            session.state = session.STOPPED
+        self.running = False
+    
+    def stats(self):
+        sessions = [session.stats() for session in self.sessions.values()]
+        states = {}
+        for session in self.sessions.values():
+            states[session.state] = states.get(session.state, 0) + 1
+        return {
+            "sessions": len(sessions),
+            "states": states,
+            "packets": sum(s["packets"] for s in sessions),
+            "bytes": sum(s["bytes"] for s in sessions),
+            "tokens": self.bucket.tokens if self.bucket != None else None,
+            "perSession": sessions
+        }
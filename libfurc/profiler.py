@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+import functools
+import random
+import time
+
+#Samples kept per handler for the percentiles
+RESERVOIR_SIZE = 10000
+
+class HandlerProfile:
+    def __init__(self, name, opcode):
+        self.name = name
+        self.opcode = opcode
+        self.calls = 0
+        self.totalTime = 0.0 #Decoding only, listener time is kept apart
+        self.listenerTime = 0.0
+        self.bytes = 0
+        self.samples = []
+    
+    def record(self, elapsed, listenerTime, size):
+        self.calls += 1
+        self.totalTime += elapsed
+        self.listenerTime += listenerTime
+        self.bytes += size
+        #Reservoir sampling, so long sessions keep a fair spread of samples
+        if len(self.samples) < RESERVOIR_SIZE:
+            self.samples.append(elapsed)
+        else:
+            i = random.randrange(self.calls)
+            if i < RESERVOIR_SIZE:
+                self.samples[i] = elapsed
+    
+    def percentile(self, p):
+        if not self.samples:
+            return 0.0
+        samples = sorted(self.samples)
+        return samples[min(len(samples) - 1, int(len(samples) * p))]
+    
+    def stats(self):
+        return {
+            "handler": self.name,
+            "opcode": self.opcode,
+            "calls": self.calls,
+            "totalTime": self.totalTime,
+            "meanTime": self.totalTime / self.calls if self.calls else 0.0,
+            "p99Time": self.percentile(0.99),
+            "listenerTime": self.listenerTime,
+            "bytes": self.bytes
+        }
+
+class DecodeProfiler:
+    """
+        Times every message_* handler of a PacketHooks (or Client) while
+        enabled. enable() and disable() can be called at any time on a
+        running client, the dispatch tables are swapped in place.
+        
+        Time spent in listeners while a handler fires its events is counted
+        apart, so the report shows the cost of decoding alone. Calling
+        generateLookups() on the hooks, which registering a message_*
+        handler does, drops the wrappers; call enable() again after.
+    """
+    def __init__(self, hooks):
+        self.hooks = hooks
+        self.profiles = {}
+        self.enabled = False
+        self.listenerTime = 0.0
+    
+    def profileFor(self, name, opcode):
+        profile = self.profiles.get(name)
+        if profile == None:
+            profile = self.profiles[name] = HandlerProfile(name, opcode)
+        return profile
+    
+    def wrap(self, handler, name, opcode):
+        profile = self.profileFor(name, opcode)
+        profiler = self
+        @functools.wraps(handler)
+        async def _(op, data):
+            outer = profiler.listenerTime
+            profiler.listenerTime = 0.0
+            start = time.perf_counter()
+            try:
+                await handler(op, data)
+            finally:
+                elapsed = time.perf_counter() - start
+                inner = profiler.listenerTime
+                profile.record(elapsed - inner, inner, len(data) + len(opcode))
+                profiler.listenerTime = outer + elapsed
+        _.profiled = handler
+        return _
+    
+    def enable(self):
+        hooks = self.hooks
+        if self.enabled:
+            self.disable()
+        #message_61 only routes to the extension handlers, which are timed
+        #on their own, so it's left alone
+        for i, handler in enumerate(hooks.handlers):
+            if i != 61:
+                hooks.handlers[i] = self.wrap(handler, "message_{}".format(i), chr(32 + i))
+        for i, handler in enumerate(hooks.handlers61):
+            hooks.handlers61[i] = self.wrap(handler, "message_61_{}".format(i), "]" + chr(32 + i))
+        
+        fire = hooks.fire
+        profiler = self
+        async def timedFire(name, *args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return await fire(name, *args, **kwargs)
+            finally:
+                profiler.listenerTime += time.perf_counter() - start
+        hooks.fire = timedFire
+        hooks.updateSubscriptions()
+        self.enabled = True
+    
+    def disable(self):
+        if not self.enabled:
+            return
+        hooks = self.hooks
+        hooks.handlers = [getattr(h, "profiled", h) for h in hooks.handlers]
+        hooks.handlers61 = [getattr(h, "profiled", h) for h in hooks.handlers61]
+        if "fire" in hooks.__dict__:
+            del hooks.fire
+        hooks.updateSubscriptions()
+        self.enabled = False
+    
+    def reset(self):
+        self.profiles = {}
+    
+    def results(self, sort = "totalTime"):
+        results = [profile.stats() for profile in self.profiles.values() if profile.calls]
+        results.sort(key = lambda r: r[sort], reverse = True)
+        return results
+    
+    def report(self, sort = "totalTime", limit = None):
+        lines = ["{:<16} {:>6} {:>9} {:>11} {:>10} {:>10} {:>12} {:>10}".format(
+            "handler", "opcode", "calls", "total ms", "mean us", "p99 us", "listener ms", "bytes"
+        )]
+        for r in self.results(sort)[:limit]:
+            lines.append("{:<16} {:>6} {:>9} {:>11.2f} {:>10.1f} {:>10.1f} {:>12.2f} {:>10}".format(
+                r["handler"], r["opcode"], r["calls"], r["totalTime"] * 1000,
+                r["meanTime"] * 1000000, r["p99Time"] * 1000000,
+                r["listenerTime"] * 1000, r["bytes"]
+            ))
+        return "\n".join(lines)
+    
+    def collapsed(self):
+        """
+            Collapsed stacks for flamegraph.pl and compatible tools, one line
+            per frame path with its time in microseconds.
+        """
+        lines = []
+        for profile in self.profiles.values():
+            if not profile.calls:
+                continue
+            stack = "handlePacket;"
+            if profile.name.startswith("message_61_"):
+                stack += "message_61;"
+            stack += profile.name
+            lines.append("{} {}".format(stack, int(profile.totalTime * 1000000)))
+            if profile.listenerTime:
+                lines.append("{};fire {}".format(stack, int(profile.listenerTime * 1000000)))
+        return "\n".join(lines) + "\n"
+    
+    def writeCollapsed(self, path):
+        with open(path, "w") as f:
+            f.write(self.collapsed())
@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+import asyncio
+import collections
+import time
+
+#Command classes, in lane order. Earlier lanes are always served first, so
+#a bot walking around can't hold up its own chat.
+LANES = ("control", "chat", "navigate", "query", "default", "move")
+
+#Token cost of each class. The server's flood limits aren't published,
+#these are on the safe side and can be tuned per scheduler.
+DEFAULT_COSTS = {
+    "control": 0,
+    "chat": 2,
+    "navigate": 3,
+    "query": 1,
+    "default": 1,
+    "move": 1
+}
+
+#Seconds a command may wait before it's dropped as stale. Moves are only
+#worth sending while they still reflect what the bot wants to do.
+DEFAULT_MAX_AGE = {
+    "move": 1.0
+}
+
+_commandClasses = {
+    b"connect": "control",
+    b"account": "control",
+    b"quit": "control",
+    b"m": "move",
+    b"<": "move",
+    b">": "move",
+    b"sit": "move",
+    b"stand": "move",
+    b"liedown": "move",
+    b"wh": "chat",
+    b"fdl": "navigate",
+    b"gomap": "navigate",
+    b"goback": "navigate",
+    b"vascodagama": "navigate",
+    b"dreambookmark": "query",
+    b"which": "query",
+    b"onln": "query",
+    b"look": "query",
+    b"l": "query"
+}
+
+def classify(line):
+    #Work out the command class from the raw line
+    if line[:1] in (b"\"", b":"):
+        return "chat"
+    return _commandClasses.get(line.rstrip(b"\n").split(b" ", 1)[0], "default")
+
+class TokenBucket:
+    def __init__(self, rate = 8.0, burst = 10.0):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+    
+    def refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+    
+    def wait(self, cost):
+        #Seconds until cost tokens are available, 0 if they are now
+        self.refill()
+        if self.tokens >= cost:
+            return 0
+        return (cost - self.tokens) / self.rate
+    
+    def take(self, cost):
+        self.refill()
+        self.tokens -= cost
+
+class CommandScheduler:
+    """
+        Paces commands sent through Client.command with a token bucket.
+        Each command class has a cost and its own lane; lanes are served in
+        LANES order and stale commands past their class max age are dropped.
+        Extra buckets, for example one shared between several clients, must
+        also have room before anything is sent.
+    """
+    def __init__(self, rate = 8.0, burst = 10.0, costs = None, maxAge = None,
+                 buckets = None):
+        self.bucket = TokenBucket(rate, burst)
+        self.buckets = [self.bucket] + list(buckets or [])
+        self.costs = dict(DEFAULT_COSTS)
+        self.costs.update(costs or {})
+        self.maxAge = dict(DEFAULT_MAX_AGE)
+        self.maxAge.update(maxAge or {})
+        self.lanes = dict((lane, collections.deque()) for lane in LANES)
+        self.client = None
+        self.worker = None
+        self.wakeup = None
+        
+        #Stats
+        self.sent = collections.Counter()
+        self.dropped = collections.Counter()
+    
+    def attach(self, client):
+        self.client = client
+    
+    @property
+    def depth(self):
+        return sum(len(lane) for lane in self.lanes.values())
+    
+    def submit(self, line, kind = None):
+        """
+            Queue a line. Returns a future that becomes True once it's been
+            handed to Client.send, or False if it was dropped.
+        """
+        loop = asyncio.get_running_loop()
+        kind = kind or classify(line)
+        if kind not in self.lanes:
+            kind = "default"
+        
+        future = loop.create_future()
+        self.lanes[kind].append((time.monotonic(), line, future))
+        
+        if self.worker == None or self.worker.done():
+            self.wakeup = asyncio.Event()
+            self.worker = asyncio.ensure_future(self.work())
+        self.wakeup.set()
+        return future
+    
+    def next(self):
+        now = time.monotonic()
+        for kind in LANES:
+            lane = self.lanes[kind]
+            maxAge = self.maxAge.get(kind)
+            while lane:
+                queued, line, future = lane[0]
+                if maxAge != None and now - queued > maxAge:
+                    lane.popleft()
+                    self.dropped[kind] += 1
+                    if not future.done():
+                        future.set_result(False)
+                    continue
+                return kind, lane
+        return None, None
+    
+    async def work(self):
+        while True:
+            kind, lane = self.next()
+            if lane == None:
+                self.wakeup.clear()
+                await self.wakeup.wait()
+                continue
+            
+            cost = self.costs.get(kind, 1)
+            delay = max(bucket.wait(cost) for bucket in self.buckets)
+            if delay > 0:
+                #Something more important may show up while we wait, so pick
+                #again afterwards rather than committing to this command
+                await asyncio.sleep(delay)
+                continue
+            
+            queued, line, future = lane.popleft()
+            for bucket in self.buckets:
+                bucket.take(cost)
+            self.sent[kind] += 1
+            
+            result = False
+            if self.client != None:
+                result = await self.client.send(line)
+            if not future.done():
+                future.set_result(result)
+    
+    def cancel(self):
+        #Drop everything still queued, for when the client goes away
+        for kind, lane in self.lanes.items():
+            while lane:
+                queued, line, future = lane.popleft()
+                self.dropped[kind] += 1
+                if not future.done():
+                    future.set_result(False)
+        if self.worker != None:
+            self.worker.cancel()
+            self.worker = None
+    
+    def stats(self):
+        return {
+            "tokens": self.bucket.tokens,
+            "depth": dict((kind, len(lane)) for kind, lane in self.lanes.items()),
+            "sent": dict(self.sent),
+            "dropped": dict(self.dropped)
+        }
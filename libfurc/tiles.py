@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+from array import array
+from . import base
+try:
+    import numpy
+    haveNumpy = True
+except ModuleNotFoundError:
+    haveNumpy = False
+
+#Tile update records are 6 bytes, three 2 digit base220 numbers: x, y and
+#the ID. Runs of the same tile are packed into the coordinates, every 1000
+#in x is 48 repeats and every 1000 in y is 1.
+RECORD_SIZE = 6
+
+class TileUpdates:
+    """
+        Columnar result of a SetFloor/SetWall/SetObject/SetEffect/SetSFX/
+        SetAmbient packet. x, y, id and repeats are parallel arrays, typed
+        array("H") normally or uint16 ndarrays when NumPy is installed.
+        Iterating or indexing gives the old {"pos", "id", "repeats"} dicts.
+    """
+    def __init__(self, x, y, id, repeats):
+        self.x = x
+        self.y = y
+        self.id = id
+        self.repeats = repeats
+    
+    def __repr__(self):
+        return "<TileUpdates {} records>".format(len(self))
+    
+    def __len__(self):
+        return len(self.id)
+    
+    def __getitem__(self, i):
+        return {
+            "pos": (int(self.x[i]), int(self.y[i])),
+            "id": int(self.id[i]),
+            "repeats": int(self.repeats[i])
+        }
+    
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+    
+    def records(self):
+        #(x, y, id, repeats) tuples, cheaper than the dicts
+        if haveNumpy and isinstance(self.id, numpy.ndarray):
+            return zip(self.x.tolist(), self.y.tolist(), self.id.tolist(), self.repeats.tolist())
+        return zip(self.x, self.y, self.id, self.repeats)
+    
+    def toDicts(self):
+        return list(self)
+    
+    @classmethod
+    def fromRecords(cls, data, useNumpy = None):
+        count = len(data) // RECORD_SIZE #A trailing partial record is ignored
+        if useNumpy == None:
+            useNumpy = haveNumpy
+        
+        if useNumpy:
+            raw = numpy.frombuffer(data, numpy.uint8, count * RECORD_SIZE)
+            digits = raw.reshape(count, 3, 2).astype(numpy.int32) - 35
+            if count and (digits.min() < 0 or digits.max() > 219):
+                raise ValueError("Invalid base220 character!")
+            values = digits[:, :, 0] + digits[:, :, 1] * 220
+            x, y, id = values[:, 0], values[:, 1], values[:, 2]
+            repeats = 48 * (x // 1000) + y // 1000
+            return cls(
+                (x % 1000).astype(numpy.uint16),
+                (y % 1000).astype(numpy.uint16),
+                id.astype(numpy.uint16),
+                repeats.astype(numpy.uint16)
+            )
+        
+        values = base.b220decodeMany(data, 2, count * 3)
+        xs, ys = values[0::3], values[1::3]
+        return cls(
+            array("H", [v % 1000 for v in xs]),
+            array("H", [v % 1000 for v in ys]),
+            array("H", values[2::3]),
+            array("H", [48 * (x // 1000) + y // 1000 for x, y in zip(xs, ys)])
+        )
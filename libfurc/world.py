@@ -0,0 +1,426 @@
+#!/usr/bin/env python3
+import asyncio
+from array import array
+from .dream import Dream
+
+#Which dream layer each tile event updates
+LAYER_EVENTS = {
+    "SetFloor": "_floors",
+    "SetObject": "_items",
+    "SetWall": "_walls",
+    "SetRegion": "_regions",
+    "SetEffect": "_effects",
+    "SetAmbient": "_ambient"
+}
+
+#Default size until the server tells us otherwise, grown on demand
+DEFAULT_WIDTH = 52
+DEFAULT_HEIGHT = 100
+
+def _fill(layer, start, count, value):
+    #Works for both the list and array backed layers
+    count = min(count, len(layer) - start)
+    if count <= 0:
+        return
+    if isinstance(layer, array):
+        #Keep to the layer's width, walls are a byte each
+        value &= (1 << (8 * layer.itemsize)) - 1
+        layer[start:start + count] = array(layer.typecode, [value]) * count
+    else:
+        layer[start:start + count] = [value] * count
+
+class Avatar:
+    def __init__(self, fuid, pos = (0, 0), direction = 0, shape = 0, name = None,
+                 colors = None, flags = 0, afkTime = 0, scale = 100):
+        self.fuid = fuid
+        self.pos = pos
+        self.direction = direction
+        self.shape = shape
+        self.name = name
+        self.colors = colors
+        self.flags = flags
+        self.afkTime = afkTime
+        self.scale = scale
+        self.offset = (0, 0)
+        self.visible = True
+    
+    def __repr__(self):
+        return "<Avatar {} {} at {}>".format(self.fuid, self.name, self.pos)
+
+class SpatialIndex:
+    """
+        Avatars bucketed into a grid of cellSize tiles, for "who is near"
+        queries that only look at the buckets they overlap instead of every
+        furre in the dream. Positions are protocol coordinates.
+    """
+    def __init__(self, cellSize = 8):
+        self.cellSize = cellSize
+        self.positions = {}
+        self.tiles = {}
+        self.buckets = {}
+    
+    def __len__(self):
+        return len(self.positions)
+    
+    def __contains__(self, fuid):
+        return fuid in self.positions
+    
+    def bucketOf(self, pos):
+        return (pos[0] // self.cellSize, pos[1] // self.cellSize)
+    
+    def remove(self, fuid):
+        pos = self.positions.pop(fuid, None)
+        if pos == None:
+            return
+        here = self.tiles[pos]
+        here.discard(fuid)
+        if not here:
+            del self.tiles[pos]
+        bucket = self.bucketOf(pos)
+        members = self.buckets[bucket]
+        members.discard(fuid)
+        if not members:
+            del self.buckets[bucket]
+    
+    def move(self, fuid, pos):
+        old = self.positions.get(fuid)
+        if old == pos:
+            return
+        if old != None:
+            self.remove(fuid)
+        if pos == None:
+            return
+        self.positions[fuid] = pos
+        self.tiles.setdefault(pos, set()).add(fuid)
+        self.buckets.setdefault(self.bucketOf(pos), set()).add(fuid)
+    
+    def clear(self):
+        self.positions = {}
+        self.tiles = {}
+        self.buckets = {}
+    
+    def at(self, x, y):
+        return set(self.tiles.get((x, y), ()))
+    
+    def rect(self, x1, y1, x2, y2):
+        #Inclusive on both corners
+        x1, x2 = min(x1, x2), max(x1, x2)
+        y1, y2 = min(y1, y2), max(y1, y2)
+        bx1, by1 = self.bucketOf((x1, y1))
+        bx2, by2 = self.bucketOf((x2, y2))
+        result = set()
+        positions = self.positions
+        for bx in range(bx1, bx2 + 1):
+            for by in range(by1, by2 + 1):
+                members = self.buckets.get((bx, by))
+                if not members:
+                    continue
+                inside = bx1 < bx < bx2 and by1 < by < by2
+                for fuid in members:
+                    if inside:
+                        result.add(fuid)
+                        continue
+                    x, y = positions[fuid]
+                    if x1 <= x <= x2 and y1 <= y <= y2:
+                        result.add(fuid)
+        return result
+    
+    def radius(self, x, y, r):
+        #Straight line distance, in protocol units
+        result = set()
+        positions = self.positions
+        r2 = r * r
+        for fuid in self.rect(x - r, y - r, x + r, y + r):
+            px, py = positions[fuid]
+            if (px - x) ** 2 + (py - y) ** 2 <= r2:
+                result.add(fuid)
+        return result
+
+class WorldState:
+    """
+        Keeps a Dream grid and an avatar table up to date from a client's
+        packet stream. Tile and avatar lookups are dictionary or index
+        lookups. Instead of an event per tile, changes are gathered per
+        event loop tick and fired once as "WorldChanged" with a bounding
+        box (x1, y1, x2, y2) per changed layer and the set of changed fuids.
+        
+        Coordinates are the protocol's, where x is doubled: floors, items and
+        the other one-per-cell layers live at column x // 2, walls have two
+        per cell and use x as is.
+    """
+    def __init__(self, client = None, width = DEFAULT_WIDTH, height = DEFAULT_HEIGHT):
+        self.client = None
+        self.dream = None
+        self.avatars = {}
+        self.spatial = SpatialIndex()
+        self.sfx = {}
+        self.dirty = {}
+        self.dirtyAvatars = set()
+        self.flushScheduled = False
+        self.reset(width, height)
+        if client != None:
+            self.attach(client)
+    
+    def attach(self, client):
+        self.client = client
+        self.handlers = {}
+        for event in LAYER_EVENTS:
+            self.handlers[event] = self.setTiles
+        self.handlers["SetSFX"] = self.setSFX
+        self.handlers["LoadMap"] = self.loadMap
+        self.handlers["DreamResize"] = self.dreamResize
+        self.handlers["SpawnAvatar"] = self.spawnAvatar
+        self.handlers["FurreArrive"] = self.spawnAvatar
+        self.handlers["MoveAvatar"] = self.moveAvatar
+        self.handlers["AnimateAvatar"] = self.moveAvatar
+        self.handlers["HideAvatar"] = self.hideAvatar
+        self.handlers["SetAvatarColors"] = self.setAvatarColors
+        self.handlers["OffsetAvatar"] = self.offsetAvatar
+        self.handlers["RemoveAvatar"] = self.removeAvatar
+        self.handlers["RemoveAvatarID"] = self.removeAvatar
+        
+        #Tile events carry their layer in the event name, the wildcard
+        #doesn't suit us, so bind one closure per event instead
+        self.bound = {}
+        for event, handler in self.handlers.items():
+            if handler == self.setTiles:
+                bound = self._tileHandler(event)
+            else:
+                bound = handler
+            self.bound[event] = bound
+            client.hook(event, bound)
+    
+    def detach(self):
+        if self.client == None:
+            return
+        for event, bound in self.bound.items():
+            self.client.off(event, bound)
+        self.client = None
+    
+    def _tileHandler(self, event):
+        layer = LAYER_EVENTS[event]
+        async def _(updates):
+            self.setTiles(layer, updates)
+        return _
+    
+    def reset(self, width = None, height = None):
+        width = width or (self.dream.width if self.dream else DEFAULT_WIDTH)
+        height = height or (self.dream.height if self.dream else DEFAULT_HEIGHT)
+        self.dream = Dream(version = 1.6, width = width, height = height)
+        self.avatars = {}
+        self.spatial.clear()
+        self.sfx = {}
+        self.markDirty("*", 0, 0, width * 2 - 1, height - 1)
+    
+    def resize(self, width, height):
+        #Keep what we have, copying it into a grid of the new size
+        old = self.dream
+        avatars, spatial, sfx = self.avatars, self.spatial, self.sfx
+        self.spatial = SpatialIndex(spatial.cellSize)
+        self.reset(width, height)
+        self.avatars, self.spatial, self.sfx = avatars, spatial, sfx
+        for layer in LAYER_EVENTS.values():
+            perCell = 2 if layer == "_walls" else 1
+            src = getattr(old, layer)
+            dst = getattr(self.dream, layer)
+            if src == None or dst == None:
+                continue
+            rows = min(old.width, width) * perCell
+            h = min(old.height, height)
+            for x in range(rows):
+                dst[x * height:x * height + h] = src[x * old.height:x * old.height + h]
+    
+    #Lookups
+    def index(self, x, y, layer = "_floors"):
+        if layer == "_walls":
+            return self.dream.coordinateToIndex(x, y)
+        return self.dream.coordinateToIndex(x // 2, y)
+    
+    def tile(self, x, y):
+        dream = self.dream
+        index = dream.coordinateToIndex(x // 2, y)
+        wall = dream.coordinateToIndex(x, y)
+        return {
+            "floor": dream._floors[index],
+            "item": dream._items[index],
+            "wall": dream._walls[wall],
+            "region": dream._regions[index],
+            "effect": dream._effects[index],
+            "ambient": dream._ambient[index],
+            "sfx": self.sfx.get((x, y), 0)
+        }
+    
+    def floor(self, x, y):
+        return self.dream._floors[self.dream.coordinateToIndex(x // 2, y)]
+    
+    def item(self, x, y):
+        return self.dream._items[self.dream.coordinateToIndex(x // 2, y)]
+    
+    def wall(self, x, y):
+        return self.dream._walls[self.dream.coordinateToIndex(x, y)]
+    
+    def avatar(self, fuid):
+        return self.avatars.get(fuid)
+    
+    def avatarsOn(self, x, y):
+        return [self.avatars[fuid] for fuid in self.spatial.at(x, y)]
+    
+    def avatarsIn(self, x1, y1, x2, y2):
+        return [self.avatars[fuid] for fuid in self.spatial.rect(x1, y1, x2, y2)]
+    
+    def avatarsNear(self, x, y, r):
+        return [self.avatars[fuid] for fuid in self.spatial.radius(x, y, r)]
+    
+    #Dirty tracking
+    def markDirty(self, layer, x1, y1, x2, y2):
+        box = self.dirty.get(layer)
+        if box == None:
+            self.dirty[layer] = (x1, y1, x2, y2)
+        else:
+            self.dirty[layer] = (min(box[0], x1), min(box[1], y1), max(box[2], x2), max(box[3], y2))
+        self.scheduleFlush()
+    
+    def scheduleFlush(self):
+        if self.flushScheduled or self.client == None:
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        self.flushScheduled = True
+        loop.call_soon(lambda: asyncio.ensure_future(self.flush()))
+    
+    async def flush(self):
+        self.flushScheduled = False
+        if not self.dirty and not self.dirtyAvatars:
+            return
+        dirty, avatars = self.dirty, self.dirtyAvatars
+        self.dirty, self.dirtyAvatars = {}, set()
+        if self.client != None:
+            await self.client.fire("WorldChanged", dirty, avatars)
+    
+    #Tiles
+    def ensureSize(self, x, y, layer):
+        column = x if layer == "_walls" else x // 2
+        width = self.dream.width * (2 if layer == "_walls" else 1)
+        if column < width and y < self.dream.height:
+            return
+        self.resize(
+            max(self.dream.width, (x // 2) + 1),
+            max(self.dream.height, y + 1)
+        )
+    
+    def setTiles(self, layer, updates):
+        dream = self.dream
+        if hasattr(updates, "records"):
+            records = updates.records()
+        else:
+            #SetRegion is a list of SetRegionEntry records, without runs
+            records = [(u.pos[0], u.pos[1], u.id, 0) for u in updates]
+        
+        x1, y1, x2, y2 = None, None, None, None
+        walls = layer == "_walls"
+        for x, y, value, repeats in records:
+            self.ensureSize(x, y, layer)
+            dream = self.dream
+            target = getattr(dream, layer)
+            start = dream.coordinateToIndex(x if walls else x // 2, y)
+            #A run covers this tile and the next repeats tiles in file order
+            _fill(target, start, repeats + 1, value)
+            
+            if x1 == None:
+                x1, y1, x2, y2 = x, y, x, y
+            else:
+                x1, y1 = min(x1, x), min(y1, y)
+                x2, y2 = max(x2, x), max(y2, y)
+            if repeats:
+                #Runs walk down the column and can wrap into the next ones
+                end = start + repeats
+                height = dream.height
+                perCell = 1 if walls else 2
+                x2 = max(x2, (end // height) * perCell)
+                if end // height != start // height:
+                    y1, y2 = 0, height - 1
+                else:
+                    y2 = max(y2, end % height)
+        
+        if x1 != None:
+            self.markDirty(layer, x1, y1, x2, y2)
+    
+    async def setSFX(self, updates):
+        #SFX aren't a dream layer, but runs walk the tiles in the same order
+        for x, y, value, repeats in updates.records():
+            self.ensureSize(x, y, "sfx")
+            height = self.dream.height
+            start = self.dream.coordinateToIndex(x // 2, y)
+            end = min(start + repeats, self.dream.width * height - 1)
+            for i in range(start, end + 1):
+                column, row = divmod(i, height)
+                self.sfx[(column * 2 + x % 2, row)] = value
+            
+            if end // height != start // height:
+                self.markDirty("sfx", x, 0, (end // height) * 2 + x % 2, height - 1)
+            else:
+                self.markDirty("sfx", x, y, x, end % height)
+    
+    async def loadMap(self, name):
+        self.reset()
+    
+    async def dreamResize(self, size):
+        self.resize(size[0] // 2, size[1])
+    
+    #Avatars
+    def place(self, avatar, pos):
+        avatar.pos = pos
+        self.spatial.move(avatar.fuid, pos)
+        self.dirtyAvatars.add(avatar.fuid)
+        self.scheduleFlush()
+    
+    async def spawnAvatar(self, fuid, pos, direction, shape, *args):
+        avatar = self.avatars.get(fuid)
+        if avatar == None:
+            avatar = Avatar(fuid, None)
+            self.avatars[fuid] = avatar
+        avatar.direction = direction
+        avatar.shape = shape
+        avatar.visible = True
+        if len(args) == 5: #SpawnAvatar, FurreArrive carries unknowns instead
+            avatar.name, avatar.colors, avatar.flags, avatar.afkTime, avatar.scale = args
+        self.place(avatar, pos)
+    
+    async def moveAvatar(self, fuid, pos, direction, shape):
+        avatar = self.avatars.get(fuid)
+        if avatar == None:
+            avatar = Avatar(fuid, None)
+            self.avatars[fuid] = avatar
+        avatar.direction = direction
+        avatar.shape = shape
+        avatar.visible = True
+        self.place(avatar, pos)
+    
+    async def hideAvatar(self, fuid, pos):
+        avatar = self.avatars.get(fuid)
+        if avatar != None:
+            avatar.visible = False
+            self.place(avatar, pos)
+    
+    async def setAvatarColors(self, fuid, direction, shape, colors):
+        avatar = self.avatars.get(fuid)
+        if avatar != None:
+            avatar.direction = direction
+            avatar.shape = shape
+            avatar.colors = colors
+            self.dirtyAvatars.add(fuid)
+            self.scheduleFlush()
+    
+    async def offsetAvatar(self, fuid, offset):
+        avatar = self.avatars.get(fuid)
+        if avatar != None:
+            avatar.offset = offset
+            self.dirtyAvatars.add(fuid)
+            self.scheduleFlush()
+    
+    async def removeAvatar(self, fuid):
+        avatar = self.avatars.pop(fuid, None)
+        if avatar != None:
+            self.place(avatar, None)